@@ -0,0 +1,54 @@
+import argparse
+import os
+import sys
+import numpy as np
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(root_dir)
+import query_executor
+from query_point_algorithms import trim_extremities
+from knn_simulation import mock_knn_api, random_points
+
+# load test the query executor offline, running a trim_extremities plan against the
+# mock k nearest neighbours API with the given latency and failure rate
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--num_data_points", type=int, default=10000)
+parser.add_argument("-k", "--k_nearest_neighbours", type=int, default=20)
+parser.add_argument("-c", "--concurrency", type=int, nargs="+", default=[1, 8, 64])
+parser.add_argument("-r", "--rate", type=float, default=None)
+parser.add_argument("-l", "--latency", type=float, default=0.05)
+parser.add_argument("-f", "--failure_rate", type=float, default=0.05)
+parser.add_argument("-p", "--cost_per_query", type=float, default=0.032)
+parser.add_argument("-s", "--seed", type=int, default=0)
+args = parser.parse_args()
+
+np.random.seed(args.seed)
+data_points = random_points.uniform_random_points(
+    args.num_data_points, [0, 10], [0, 10]
+)
+query_points = trim_extremities.get_query_points(data_points, args.k_nearest_neighbours)
+
+print(
+    f"{'concurrency':>12} {'queries':>8} {'calls':>8} {'failed':>7} {'covered':>8}"
+    f" {'seconds':>8} {'queries/s':>10} {'cost':>8}"
+)
+
+for concurrency in args.concurrency:
+    api = mock_knn_api.MockKNNAPI(
+        data_points,
+        args.k_nearest_neighbours,
+        latency=args.latency,
+        failure_rate=args.failure_rate,
+        cost_per_query=args.cost_per_query,
+        seed=args.seed,
+    )
+    report = query_executor.execute(
+        query_points, api, max_concurrency=concurrency, rate=args.rate, seed=args.seed
+    )
+
+    print(
+        f"{concurrency:>12} {len(query_points):>8} {report['calls']:>8}"
+        f" {report['failed']:>7} {len(report['records']):>8}"
+        f" {report['seconds']:>8.2f} {report['queries_per_second']:>10.1f}"
+        f" {api.cost:>8.2f}"
+    )
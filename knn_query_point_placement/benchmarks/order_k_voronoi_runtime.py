@@ -0,0 +1,37 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(root_dir)
+from query_point_algorithms import order_k_voronoi
+from knn_simulation import random_points
+
+# time the order k Voronoi engine on uniform random points for a grid of n and k
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "-n", "--num_data_points", type=int, nargs="+", default=[1000, 2000, 5000, 10000]
+)
+parser.add_argument(
+    "-k", "--k_nearest_neighbours", type=int, nargs="+", default=[5, 20, 60]
+)
+parser.add_argument("-s", "--seed", type=int, default=0)
+args = parser.parse_args()
+
+print(f"{'n':>8} {'k':>4} {'cells':>10} {'seconds':>10} {'us per cell':>12}")
+
+for n in args.num_data_points:
+    for k in args.k_nearest_neighbours:
+        np.random.seed(args.seed)
+        data_points = random_points.uniform_random_points(n, [0, 10], [0, 10])
+
+        start = time.perf_counter()
+        diagram = order_k_voronoi.order_k_voronoi(data_points, k)
+        seconds = time.perf_counter() - start
+
+        n_cells = len(diagram["neighbour_sets"])
+        print(
+            f"{n:>8} {k:>4} {n_cells:>10} {seconds:>10.2f} {1e6 * seconds / n_cells:>12.1f}"
+        )
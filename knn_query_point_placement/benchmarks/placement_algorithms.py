@@ -0,0 +1,231 @@
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from scipy.spatial import KDTree
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(root_dir)
+from query_point_algorithms import (
+    greedy_set_cover,
+    grid_search,
+    ilp_set_cover,
+    trim_extremities,
+    uniform_random,
+)
+from knn_simulation import construct_optimal_solution, random_points
+
+# compare the placement algorithms on generated instances, recording for every run the
+# number of query points, the ratio to the planted number of query points (or to the
+# lower bound n / k when nothing is planted), the wall time, the peak memory traced by
+# tracemalloc and the number of neighbour queries made against a KDTree
+
+
+ALGORITHMS = {
+    "uniform_random": lambda data_points, k: uniform_random.get_query_points(
+        data_points, k
+    ),
+    "trim_extremities": lambda data_points, k: trim_extremities.get_query_points(
+        data_points, k
+    ),
+    "greedy_set_cover": lambda data_points, k: greedy_set_cover.get_query_points(
+        data_points, k
+    ),
+    "ilp_set_cover": lambda data_points, k: ilp_set_cover.get_query_points(
+        data_points, k, time_limit=60, threads=1
+    ),
+    "grid_search": lambda data_points, k: grid_search.get_query_points(
+        data_points,
+        k,
+        [data_points["x"].min(), data_points["x"].max()],
+        [data_points["y"].min(), data_points["y"].max()],
+        200,
+        workers=1,
+    ),
+}
+
+
+def planted_instance(n_points, k_nearest_neighbours):
+    # n_points / k clusters of k points, each one returned by a planted query point
+    n_query_points = max(n_points // k_nearest_neighbours, 1)
+    query_points, data_points = construct_optimal_solution.simulation(
+        n_query_points, n_query_points, [0, 10], [0, 10], k_nearest_neighbours
+    )
+
+    return data_points[["x", "y"]], len(query_points)
+
+
+def uniform_instance(n_points, k_nearest_neighbours):
+    data_points = random_points.uniform_random_points(n_points, [0, 10], [0, 10])
+
+    return pd.DataFrame(data_points, columns=["x", "y"]), None
+
+
+GENERATORS = {"planted": planted_instance, "uniform": uniform_instance}
+
+
+_kdtree_query = KDTree.query
+
+
+def _count_queries(counter):
+    # wrap KDTree.query so that every point queried is counted
+    def counted_query(self, x, *args, **kwargs):
+        counter[0] += np.asarray(x).reshape(-1, self.m).shape[0]
+        return _kdtree_query(self, x, *args, **kwargs)
+
+    KDTree.query = counted_query
+
+
+def _silently(function, *args):
+    # the algorithms print their progress, which is not wanted in the table
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        return function(*args)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def run(algorithm, data_points, k_nearest_neighbours, trace_memory=True):
+    # runs in a worker process. Tracing memory slows python down a lot, so the time
+    # and the number of queries come from one run and the peak memory from another
+    counter = [0]
+    _count_queries(counter)
+
+    start = time.perf_counter()
+    try:
+        query_points = _silently(
+            ALGORITHMS[algorithm], data_points, k_nearest_neighbours
+        )
+    except Exception as e:
+        return {"error": type(e).__name__}
+    seconds = time.perf_counter() - start
+    n_queries = counter[0]
+
+    peak_memory = np.nan
+    if trace_memory:
+        tracemalloc.start()
+        _silently(ALGORITHMS[algorithm], data_points, k_nearest_neighbours)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    # check every data point is returned by the plan
+    coordinates = data_points[["x", "y"]].to_numpy()
+    neighbours = KDTree(coordinates).query(
+        np.asarray(query_points).reshape(-1, 2), k_nearest_neighbours
+    )[1]
+    covered = len(np.unique(neighbours)) == len(coordinates)
+
+    return {
+        "query_points": len(query_points),
+        "covers": covered,
+        "seconds": seconds,
+        "peak_mb": peak_memory / 2**20,
+        "queries": n_queries,
+        "error": None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n", "--num_data_points", type=int, nargs="+", default=[100, 1000]
+    )
+    parser.add_argument(
+        "-k", "--k_nearest_neighbours", type=int, nargs="+", default=[5, 10]
+    )
+    parser.add_argument(
+        "-g", "--generators", nargs="+", default=list(GENERATORS), choices=GENERATORS
+    )
+    parser.add_argument(
+        "-a",
+        "--algorithms",
+        nargs="+",
+        default=["uniform_random", "trim_extremities", "greedy_set_cover"],
+        choices=ALGORITHMS,
+    )
+    parser.add_argument("-r", "--repeats", type=int, default=1)
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default=None, help="also write a csv here")
+    parser.add_argument(
+        "--skip_memory",
+        action="store_true",
+        help="do not rerun each algorithm to trace its peak memory",
+    )
+    args = parser.parse_args()
+
+    # generate every instance up front so each algorithm sees the same ones
+    instances = []
+    for generator in args.generators:
+        for n in args.num_data_points:
+            for k in args.k_nearest_neighbours:
+                for repeat in range(args.repeats):
+                    np.random.seed(args.seed + repeat)
+                    data_points, planted = GENERATORS[generator](n, k)
+                    instances += [(generator, n, k, repeat, data_points, planted)]
+
+    runs = [
+        (algorithm, instance) for instance in instances for algorithm in args.algorithms
+    ]
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [
+            executor.submit(
+                run, algorithm, instance[4], instance[2], not args.skip_memory
+            )
+            for algorithm, instance in runs
+        ]
+        results = [future.result() for future in futures]
+
+    rows = []
+    for (algorithm, instance), result in zip(runs, results):
+        generator, n, k, repeat, data_points, planted = instance
+        baseline = planted if planted is not None else -(-len(data_points) // k)
+        rows += [
+            {
+                "generator": generator,
+                "n": len(data_points),
+                "k": k,
+                "repeat": repeat,
+                "algorithm": algorithm,
+                "query_points": result.get("query_points"),
+                "ratio": result["query_points"] / baseline
+                if result["error"] is None
+                else None,
+                "covers": result.get("covers"),
+                "seconds": result.get("seconds"),
+                "peak_mb": result.get("peak_mb"),
+                "queries": result.get("queries"),
+                "error": result["error"],
+            }
+        ]
+
+    results = pd.DataFrame(rows)
+    if args.output is not None:
+        results.to_csv(args.output, index=False)
+
+    # average over the repeats for the table
+    table = (
+        results.groupby(["generator", "n", "k", "algorithm"], sort=False)
+        .agg(
+            query_points=("query_points", "mean"),
+            ratio=("ratio", "mean"),
+            covers=("covers", "all"),
+            seconds=("seconds", "mean"),
+            peak_mb=("peak_mb", "max"),
+            queries=("queries", "mean"),
+            errors=("error", "count"),
+        )
+        .reset_index()
+    )
+    print(table.to_string(index=False, float_format=lambda x: f"{x:.3g}"))
+
+
+if __name__ == "__main__":
+    main()
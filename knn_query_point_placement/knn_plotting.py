@@ -2,6 +2,11 @@ import matplotlib.pyplot as plt
 from scipy.spatial import KDTree
 import numpy as np
 from matplotlib.pyplot import cm
+from matplotlib.collections import LineCollection
+
+# above this many points or edges the artists are rasterized, so figures of large
+# plans stay quick to draw and small to save
+RASTERIZE_ABOVE = 10000
 
 
 def plot(
@@ -12,30 +17,49 @@ def plot(
     query_point_labels=None,
 ):
 
+    data_points = np.asarray(data_points)
+
     plt.figure(figsize=figsize)
-    plt.scatter(data_points[:, 0], data_points[:, 1], c="b", label="Data points")
+    ax = plt.gca()
+    ax.scatter(
+        data_points[:, 0],
+        data_points[:, 1],
+        c="b",
+        label="Data points",
+        rasterized=len(data_points) > RASTERIZE_ABOVE,
+    )
 
     if query_points is not None:
-        plt.scatter(
+        query_points = np.asarray(query_points).reshape(-1, 2)
+        ax.scatter(
             query_points[:, 0],
             query_points[:, 1],
             c="r",
             label="Query points",
             marker="x",
+            rasterized=len(query_points) > RASTERIZE_ABOVE,
         )
 
-        # add lines from query points to data points
-        tree = KDTree(data_points)
-        closest_points = tree.query(query_points, k_nearest_neighbours)
-
-        for point, knn in zip(query_points, closest_points[1]):
-            for neighbour in knn:
-                plt.plot(
-                    [point[0], data_points[neighbour][0]],
-                    [point[1], data_points[neighbour][1]],
-                    c="r",
-                    linestyle="--",
-                )
+        # add lines from query points to data points, all the neighbours are found in
+        # one query and drawn as a single collection of segments
+        closest_points = KDTree(data_points).query(query_points, k_nearest_neighbours)
+        neighbours = closest_points[1].reshape(len(query_points), -1)
+
+        segments = np.stack(
+            [
+                np.repeat(query_points, neighbours.shape[1], axis=0),
+                data_points[neighbours.ravel()],
+            ],
+            axis=1,
+        )
+        ax.add_collection(
+            LineCollection(
+                segments,
+                colors="r",
+                linestyles="--",
+                rasterized=len(segments) > RASTERIZE_ABOVE,
+            )
+        )
 
         plt.legend()
 
@@ -44,7 +68,6 @@ def plot(
             plt.annotate(txt, (query_points[i][0], query_points[i][1]))
 
     # equalise the axis sizes to make inspection of closest points easier
-    ax = plt.gca()
     ax.set_aspect("equal", adjustable="box")
 
 
@@ -60,14 +83,16 @@ def plot_feasible_area(
 
     x_space, y_space = np.meshgrid(x_range, y_range)
 
-    def _in_feasible_region(x, y, A, b):
-        return np.all(np.dot(np.column_stack([x, y]), A.T) >= b, axis=1)
-
-    feasible_region = []
-    for x, y in zip(x_space, y_space):
-        feasible_region += [_in_feasible_region(x, y, A, b)]
-
-    feasible_region = np.array(feasible_region)
+    # every grid point is checked against a block of constraints in one operation,
+    # the blocks bounding the memory used for cells with many constraints
+    grid = np.stack([x_space, y_space], axis=2)
+    A = np.asarray(A).reshape(-1, 2)
+    b = np.asarray(b).ravel()
+    feasible_region = np.ones(x_space.shape, dtype=bool)
+    for start in range(0, len(A), 256):
+        feasible_region &= np.all(
+            grid @ A[start : start + 256].T >= b[start : start + 256], axis=2
+        )
 
     ax.imshow(
         feasible_region.astype(int),
@@ -1,97 +1,118 @@
 import numpy as np
-import scipy.spatial as scsp
 import pandas as pd
-import uuid
+import scipy.spatial as scsp
+from scipy.spatial import KDTree
+
+
+def _default_rng(rng):
+    # accept a np.random.Generator or a seed. Without either, draw the seed from
+    # numpy's global random state so np.random.seed still makes runs reproducible
+    if rng is None:
+        rng = np.random.randint(2**32)
+
+    return np.random.default_rng(rng)
 
 
 def generate_query_points(
-    min_query_points, max_query_points, approx_x_bounds, approx_y_bounds
+    min_query_points, max_query_points, approx_x_bounds, approx_y_bounds, rng=None
 ):
 
     # generate the query points, the idea is that if these are selected as a point
     # at which to conduct knn they will return the relevant points
+    rng = _default_rng(rng)
+
     if min_query_points == max_query_points:
         n_query_points = min_query_points
     else:
-        n_query_points = np.random.randint(min_query_points, max_query_points)
-    query_points_x = np.random.uniform(
-        approx_x_bounds[0], approx_x_bounds[1], n_query_points
-    )
-    query_points_y = np.random.uniform(
-        approx_y_bounds[0], approx_y_bounds[1], n_query_points
-    )
+        n_query_points = rng.integers(min_query_points, max_query_points)
+    query_points_x = rng.uniform(approx_x_bounds[0], approx_x_bounds[1], n_query_points)
+    query_points_y = rng.uniform(approx_y_bounds[0], approx_y_bounds[1], n_query_points)
 
     return pd.DataFrame(
         {
-            "query_point_uuid": [str(uuid.uuid4()) for _ in range(n_query_points)],
+            "query_point_id": np.arange(n_query_points, dtype=np.int32),
             "x": query_points_x,
             "y": query_points_y,
         }
     )
 
 
+def nearest_query_point_distances(query_points):
+    # the distance from each query point to its nearest other query point, the
+    # closest two points to a query point are itself and its nearest neighbour
+    coordinates = query_points[["x", "y"]].to_numpy()
+    if len(coordinates) < 2:
+        return np.full(len(coordinates), np.inf)
+
+    return KDTree(coordinates).query(coordinates, 2)[0][:, 1]
+
+
 def distances_between_query_points(query_points):
-    distance_matrix = scsp.distance.cdist(
-        query_points[["x", "y"]], query_points[["x", "y"]], "euclidean"
-    )
+    # every ordered pair of distinct query points and the distance between them, in
+    # the source, target and distance columns
+    coordinates = query_points[["x", "y"]].to_numpy()
+    ids = query_points["query_point_id"].to_numpy()
+    distance_matrix = scsp.distance.cdist(coordinates, coordinates, "euclidean")
 
-    distance_df = pd.DataFrame(
-        distance_matrix,
-        columns=query_points["query_point_uuid"],
-        index=query_points["query_point_uuid"],
-    )
-    distance_df = (
-        distance_df.reset_index()
-        .melt(id_vars="query_point_uuid", var_name="target", value_name="distance")
-        .rename(columns={"query_point_uuid": "source"})
+    target, source = np.nonzero(~np.eye(len(ids), dtype=bool))
+
+    return pd.DataFrame(
+        {
+            "source": ids[source],
+            "target": ids[target],
+            "distance": distance_matrix[source, target],
+        }
     )
 
-    distance_df = distance_df[distance_df["source"] != distance_df["target"]]
 
-    return distance_df
+def sample_uniformly_from_circles(centres, radii, n_points, rng=None):
+    # n_points from each disc, in one array ordered disc by disc. The square root
+    # makes the samples uniform over the area of the disc
+    rng = _default_rng(rng)
+    centres = np.repeat(np.asarray(centres, dtype=float), n_points, axis=0)
+    radii = np.repeat(np.asarray(radii, dtype=float), n_points)
 
+    distance = radii * np.sqrt(rng.uniform(0, 1, len(radii)))
+    angle = rng.uniform(0, 2 * np.pi, len(radii))
 
-def sample_uniformly_from_circle(centre, radius, n_points):
+    return (
+        np.column_stack([distance * np.cos(angle), distance * np.sin(angle)]) + centres
+    )
 
-    distance = np.sqrt(np.random.uniform(0, radius, n_points))
-    angle = np.random.uniform(0, 2 * np.pi, n_points)
 
-    return np.array([distance * np.cos(angle), distance * np.sin(angle)]).T + centre
+def sample_uniformly_from_circle(centre, radius, n_points, rng=None):
+    return sample_uniformly_from_circles([centre], [radius], n_points, rng)
 
 
 def sample_data_points_from_query_points(
-    query_points, points_per_query_point, scale=0.4
+    query_points, points_per_query_point, scale=0.4, rng=None, extent=None
 ):
 
-    distances = distances_between_query_points(query_points)
+    # sample each query point's data points from a disc small enough that they are
+    # its nearest neighbours, as long as scale is under a half
+    radii = nearest_query_point_distances(query_points) * scale
 
-    radius = distances.groupby("source").distance.min().reset_index()
-    query_points = query_points.merge(
-        radius, left_on="query_point_uuid", right_on="source"
+    # a lone query point has no neighbour to keep clear of, so its disc is sized by
+    # extent, the width of the region the query points were drawn from, or else by
+    # the spread of the query points
+    if extent is None:
+        extent = np.ptp(query_points[["x", "y"]].to_numpy(), axis=0).max(initial=0)
+    radii[np.isinf(radii)] = scale * (extent if extent > 0 else 1.0)
+
+    points = sample_uniformly_from_circles(
+        query_points[["x", "y"]].to_numpy(), radii, points_per_query_point, rng
     )
 
-    points_dfs = []
-    for query_point in query_points.to_dict("records"):
-        points = sample_uniformly_from_circle(
-            np.array([query_point["x"], query_point["y"]]),
-            query_point["distance"] * scale,
-            points_per_query_point,
-        )
-
-        points_dfs += [
-            pd.DataFrame(
-                {
-                    "query_point_uuid": query_point["query_point_uuid"],
-                    "point_uuid": [
-                        str(uuid.uuid4()) for _ in range(points_per_query_point)
-                    ],
-                    "x": points[:, 0],
-                    "y": points[:, 1],
-                }
-            )
-        ]
-
-    return pd.concat(points_dfs).reset_index(drop=True)
+    return pd.DataFrame(
+        {
+            "query_point_id": np.repeat(
+                query_points["query_point_id"].to_numpy(), points_per_query_point
+            ),
+            "point_id": np.arange(len(points), dtype=np.int32),
+            "x": points[:, 0],
+            "y": points[:, 1],
+        }
+    )
 
 
 def simulation(
@@ -100,14 +121,23 @@ def simulation(
     approx_x_bounds,
     approx_y_bounds,
     points_per_query_point,
+    rng=None,
 ):
 
+    rng = _default_rng(rng)
+
     query_points = generate_query_points(
-        min_query_points, max_query_points, approx_x_bounds, approx_y_bounds
+        min_query_points, max_query_points, approx_x_bounds, approx_y_bounds, rng
     )
 
     data_points = sample_data_points_from_query_points(
-        query_points, points_per_query_point
+        query_points,
+        points_per_query_point,
+        rng=rng,
+        extent=max(
+            approx_x_bounds[1] - approx_x_bounds[0],
+            approx_y_bounds[1] - approx_y_bounds[0],
+        ),
     )
 
     return query_points, data_points
@@ -1,67 +1,166 @@
 import argparse
 import os
 import pandas as pd
+import numpy as np
 import json
 import uuid
+import zipfile
 import random_points
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
 root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 sys.path.append(root_dir)
 from query_point_algorithms import nth_degree_voronoi
 
-# parse command line arguments
-parser = argparse.ArgumentParser()
-parser.add_argument("-n", "--num_data_points", type=int, default=9)
-parser.add_argument("-k", "--k_nearest_neighbours", type=int, default=3)
-parser.add_argument("-N", "--num_simulations", type=int, default=1)
-parser.add_argument("-x", "--x_bounds", type=float, nargs=2, default=[0, 10])
-parser.add_argument("-y", "--y_bounds", type=float, nargs=2, default=[0, 10])
-parser.add_argument(
-    "-d",
-    "--out_directory",
-    type=str,
-    default=os.path.abspath(os.path.join(root_dir, "../data/neighbour_set_options")),
-)
-args = parser.parse_args()
 
-# check out directory exists and if not create it
-out_path = os.path.abspath(args.out_directory)
+def simulate(n_data_points, k_nearest_neighbours, x_bounds, y_bounds, seed):
+    # one simulation with its own random stream, returning the data points, a query
+    # point for every order k voronoi cell and the ids of the data points it returns
+    rng = np.random.default_rng(seed)
+    data_points = random_points.uniform_random_points(
+        n_data_points, x_bounds, y_bounds, rng=rng
+    )
+
+    voronoi_cells = nth_degree_voronoi.VoronoiCells(
+        data_points, nth_order=k_nearest_neighbours
+    )
 
+    # find the query points in one batched pass, dropping cells with no interior
+    viable_points = voronoi_cells.find_viable_points()
+    cells = [
+        (point, cell.nearest_neighbours)
+        for point, cell in zip(viable_points, voronoi_cells.voronoi_cells)
+        if point is not None
+    ]
 
-for i in range(args.num_simulations):
+    return {
+        "data_points": data_points,
+        "query_points": np.array([point for point, _ in cells]).reshape(-1, 2),
+        "neighbours": np.array(
+            [neighbours for _, neighbours in cells], dtype=np.int32
+        ).reshape(len(cells), -1),
+    }
 
-    print("Simulation {}".format(i + 1))
 
-    # create a subdirectory of the outpath for this simulation
+def save_json(simulation, out_path):
+    # a subdirectory of the out path with the data points indexed by uuid and every
+    # cell's query point and neighbour uuids
     run_outpath = os.path.join(out_path, str(uuid.uuid4()))
     os.makedirs(run_outpath)
 
-    # generate the data points
-    data_points = random_points.uniform_random_points(
-        args.num_data_points, args.x_bounds, args.y_bounds
-    )
-
-    # calculate voronoi cells
     data_points_uuid = pd.DataFrame(
-        data_points,
+        simulation["data_points"],
         columns=["x", "y"],
-        index=[str(uuid.uuid4()) for i in range(len(data_points))],
-    )
-    voronoi_cells = nth_degree_voronoi.VoronoiCells(
-        data_points_uuid, nth_order=args.k_nearest_neighbours
+        index=[str(uuid.uuid4()) for i in range(len(simulation["data_points"]))],
     )
+    uuids = data_points_uuid.index.to_numpy()
 
-    # format the data for saving
     out_data = [
-        {
-            "query_point": cell.find_viable_point().tolist(),
-            "neighbours": cell.nearest_neighbours_uuids,
-        }
-        for cell in voronoi_cells.voronoi_cells
+        {"query_point": query_point.tolist(), "neighbours": uuids[neighbours].tolist()}
+        for query_point, neighbours in zip(
+            simulation["query_points"], simulation["neighbours"]
+        )
     ]
 
-    # save both to file
-    data_points = data_points_uuid.to_csv(os.path.join(run_outpath, "data_points.csv"))
+    data_points_uuid.to_csv(os.path.join(run_outpath, "data_points.csv"))
     with open(os.path.join(run_outpath, "neighbour_options.json"), "w") as f:
         f.write(json.dumps(out_data, indent=4))
+
+
+def _n_simulations(npz_file):
+    return sum(name.endswith("/data_points.npy") for name in npz_file.namelist())
+
+
+def append_npz(simulation, path):
+    # every simulation is stored as arrays named <simulation>/<array> in one npz file,
+    # which is a zip archive, so new simulations are appended without rewriting the
+    # ones already there
+    with zipfile.ZipFile(path, mode="a", compression=zipfile.ZIP_DEFLATED) as f:
+        i = _n_simulations(f)
+        for name, array in simulation.items():
+            with f.open(f"{i}/{name}.npy", mode="w", force_zip64=True) as member:
+                np.lib.format.write_array(member, np.asarray(array))
+
+
+def load_npz(path):
+    # the simulations in an npz dataset, in the order they were appended
+    with np.load(path) as f:
+        simulations = {}
+        for name in f.files:
+            i, array = name.split("/")
+            simulations.setdefault(int(i), {})[array] = f[name]
+
+    return [simulations[i] for i in sorted(simulations)]
+
+
+def main():
+    # parse command line arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--num_data_points", type=int, default=9)
+    parser.add_argument("-k", "--k_nearest_neighbours", type=int, default=3)
+    parser.add_argument("-N", "--num_simulations", type=int, default=1)
+    parser.add_argument("-x", "--x_bounds", type=float, nargs=2, default=[0, 10])
+    parser.add_argument("-y", "--y_bounds", type=float, nargs=2, default=[0, 10])
+    parser.add_argument(
+        "-d",
+        "--out_directory",
+        type=str,
+        default=os.path.abspath(
+            os.path.join(root_dir, "../data/neighbour_set_options")
+        ),
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=["json", "npz"],
+        default="json",
+        help="a directory of csv and json per simulation, or all of them in one npz",
+    )
+    parser.add_argument(
+        "-o",
+        "--out_file",
+        type=str,
+        default=None,
+        help="npz file to append to, by default neighbour_set_options.npz in the out"
+        " directory",
+    )
+    parser.add_argument("-w", "--workers", type=int, default=1)
+    parser.add_argument("-s", "--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    # check out directory exists and if not create it
+    out_path = os.path.abspath(args.out_directory)
+    os.makedirs(out_path, exist_ok=True)
+    out_file = args.out_file
+    if out_file is None:
+        out_file = os.path.join(out_path, "neighbour_set_options.npz")
+
+    # an independent random stream for every simulation, so the results do not depend
+    # on the number of workers
+    seed = args.seed if args.seed is not None else np.random.randint(2**32)
+    seeds = np.random.SeedSequence(seed).spawn(args.num_simulations)
+    print("Seed", seed)
+
+    simulate_args = [
+        [args.num_data_points] * args.num_simulations,
+        [args.k_nearest_neighbours] * args.num_simulations,
+        [args.x_bounds] * args.num_simulations,
+        [args.y_bounds] * args.num_simulations,
+        seeds,
+    ]
+
+    # the simulations run in the workers while this process saves them in order
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for i, simulation in enumerate(executor.map(simulate, *simulate_args)):
+
+            print("Simulation {}".format(i + 1))
+
+            if args.format == "json":
+                save_json(simulation, out_path)
+            else:
+                append_npz(simulation, out_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import os
+import sys
+import asyncio
+import numpy as np
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(root_dir)
+from query_point_algorithms import point_set
+
+
+class TransientAPIError(Exception):
+    # a failure which is worth retrying, e.g. a timeout or being rate limited
+    pass
+
+
+class MockKNNAPI:
+    # an in process stand in for a paid k nearest neighbours API, answering from a
+    # KDTree over the data points. Each call waits latency seconds, fails with a
+    # TransientAPIError with probability failure_rate, and is rejected the same way
+    # if more than max_concurrency calls are in flight. Every call is counted and
+    # charged cost_per_query, whether or not it succeeds
+    def __init__(
+        self,
+        data_points,
+        k_nearest_neighbours,
+        latency=0.0,
+        failure_rate=0.0,
+        max_concurrency=None,
+        cost_per_query=0.0,
+        seed=None,
+    ):
+
+        self.points = point_set.PointSet.from_data_points(data_points)
+        self.k_nearest_neighbours = min(k_nearest_neighbours, len(self.points))
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.max_concurrency = max_concurrency
+        self.cost_per_query = cost_per_query
+        self.rng = np.random.default_rng(seed)
+
+        self.n_calls = 0
+        self.n_failures = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    @property
+    def cost(self):
+        return self.n_calls * self.cost_per_query
+
+    async def __call__(self, query_point):
+        # the records of the nearest points to the query point, nearest first
+        self.n_calls += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            limit = self.max_concurrency
+            if limit is not None and self.in_flight > limit:
+                self.n_failures += 1
+                raise TransientAPIError("Too many requests")
+
+            await asyncio.sleep(self.latency)
+
+            if self.rng.uniform() < self.failure_rate:
+                self.n_failures += 1
+                raise TransientAPIError("Request failed")
+
+            distances, neighbours = self.points.tree.query(
+                query_point, self.k_nearest_neighbours
+            )
+        finally:
+            self.in_flight -= 1
+
+        ids = self.points.to_external(np.atleast_1d(neighbours)).tolist()
+        coordinates = self.points.coordinates[np.atleast_1d(neighbours)].tolist()
+
+        return [
+            {"id": point_id, "x": x, "y": y, "distance": distance}
+            for point_id, (x, y), distance in zip(
+                ids, coordinates, np.atleast_1d(distances).tolist()
+            )
+        ]
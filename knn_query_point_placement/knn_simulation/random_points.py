@@ -1,9 +1,13 @@
 import numpy as np
 
 
-def uniform_random_points(n_points, x_bounds, y_bounds):
+def uniform_random_points(n_points, x_bounds, y_bounds, rng=None):
 
-    x = np.random.uniform(x_bounds[0], x_bounds[1], n_points)
-    y = np.random.uniform(y_bounds[0], y_bounds[1], n_points)
+    # draw from numpy's global random state unless given a np.random.Generator
+    if rng is None:
+        rng = np.random
+
+    x = rng.uniform(x_bounds[0], x_bounds[1], n_points)
+    y = rng.uniform(y_bounds[0], y_bounds[1], n_points)
 
     return np.column_stack((x, y))
@@ -0,0 +1,178 @@
+import time
+import random
+import asyncio
+import numpy as np
+
+
+# run a plan of query points against a k nearest neighbours API. The backend is any
+# async function taking a query point and returning a list of records, e.g. a
+# knn_simulation.mock_knn_api.MockKNNAPI or a wrapper around a real API client. At
+# most max_concurrency queries are in flight at once, and with a rate they are also
+# spaced out by a token bucket. A query raising one of retry_on is retried with
+# exponential backoff and jitter, up to max_retries times. The records returned by
+# several queries are kept once, keyed by record_key.
+
+
+class TokenBucket:
+    # allows rate acquisitions a second on average, and bursts of up to capacity
+    def __init__(self, rate, capacity=None):
+
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        # the lock makes waiting callers take their turn in order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def _record_id(record):
+    return record["id"]
+
+
+class QueryExecutor:
+    def __init__(
+        self,
+        backend,
+        max_concurrency=8,
+        rate=None,
+        burst=None,
+        max_retries=3,
+        backoff=0.1,
+        max_backoff=10.0,
+        retry_on=(Exception,),
+        record_key=_record_id,
+        seed=None,
+    ):
+
+        self.backend = backend
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_on = retry_on
+        self.record_key = record_key
+        self.random = random.Random(seed)
+
+    async def _query(self, query_point, semaphore, bucket, report):
+        # the records returned for one query point, or None if every attempt failed
+        for attempt in range(self.max_retries + 1):
+            async with semaphore:
+                if bucket is not None:
+                    await bucket.acquire()
+
+                report["calls"] += 1
+                try:
+                    return await self.backend(query_point)
+                except self.retry_on as e:
+                    error = e
+
+            if attempt == self.max_retries:
+                report["errors"].append(repr(error))
+                return None
+
+            report["retries"] += 1
+            delay = min(self.backoff * 2**attempt, self.max_backoff)
+            await asyncio.sleep(delay * self.random.uniform(0.5, 1.5))
+
+    async def run(self, query_points):
+        # returns a dictionary with the records of every point returned keyed by
+        # record_key, the keys returned by each query point (None where it failed),
+        # and counts of the calls made, retries, failed query points and duplicate
+        # records, along with the wall time and the queries a second
+        query_points = np.asarray(query_points, dtype=float).reshape(-1, 2)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        bucket = None
+        if self.rate is not None:
+            bucket = TokenBucket(self.rate, self.burst)
+
+        report = {"calls": 0, "retries": 0, "errors": []}
+
+        start = time.perf_counter()
+        responses = await asyncio.gather(
+            *[
+                self._query(query_point, semaphore, bucket, report)
+                for query_point in query_points
+            ]
+        )
+        seconds = time.perf_counter() - start
+
+        records = {}
+        returned = []
+        n_duplicates = 0
+        for response in responses:
+            if response is None:
+                returned.append(None)
+                continue
+
+            keys = [self.record_key(record) for record in response]
+            for key, record in zip(keys, response):
+                if key in records:
+                    n_duplicates += 1
+                else:
+                    records[key] = record
+            returned.append(keys)
+
+        return {
+            "records": records,
+            "returned": returned,
+            "calls": report["calls"],
+            "retries": report["retries"],
+            "failed": sum(response is None for response in responses),
+            "errors": report["errors"],
+            "duplicates": n_duplicates,
+            "seconds": seconds,
+            "queries_per_second": len(query_points) / max(seconds, 1e-9),
+        }
+
+
+def execute(query_points, backend, **kwargs):
+    # run a plan from synchronous code, with kwargs passed on to QueryExecutor
+    return asyncio.run(QueryExecutor(backend, **kwargs).run(query_points))
+
+
+async def run_adaptive(planner, backend, wave_size=None, **kwargs):
+    # run an adaptive_planner.AdaptivePlanner's plan wave by wave, updating it with
+    # what each wave actually returned before planning the next. By default a wave is
+    # the max_concurrency of the executor, and kwargs are passed on to QueryExecutor
+    executor = QueryExecutor(backend, **kwargs)
+    if wave_size is None:
+        wave_size = executor.max_concurrency
+
+    reports = []
+    while not planner.done:
+        query_ids, query_points = planner.next_wave(wave_size)
+        report = await executor.run(query_points)
+        planner.update(query_ids, report["returned"])
+        reports.append(report)
+
+    records = {}
+    for report in reports:
+        records.update(report["records"])
+
+    return {
+        "records": records,
+        "calls": sum(report["calls"] for report in reports),
+        "waves": len(reports),
+        **planner.report(),
+    }
+
+
+def execute_adaptive(planner, backend, wave_size=None, **kwargs):
+    return asyncio.run(run_adaptive(planner, backend, wave_size, **kwargs))
@@ -0,0 +1,193 @@
+import os
+import sys
+import numpy as np
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(root_dir)
+from query_point_algorithms import incremental_planner, point_set, trim_extremities
+
+
+# run a plan online, wave by wave, when the index behind the API may not agree with
+# our copy of the data. Every query point has the neighbours our copy predicts it
+# returns. After each wave the points actually returned are marked as covered, and
+# the predicted points which were not returned are noted. Query points still to run
+# whose predicted points are all covered are dropped, and the uncovered points no
+# query point still to run is predicted to return get new query points: those which
+# a query point failed to return are queried from their own location, which returns
+# them if the index has them at all, and the rest get a local plan. A point which is
+# not returned by a query from its own location is taken to be missing from the
+# index. A failed query is run again until it has failed max_attempts times, when it
+# is given up and the points it was to return are planned again. Points whose query
+# points have been given up twice are left uncovered, so the plan always finishes
+# even when some queries never succeed. Every update is a handful of vectorized
+# operations on the plan.
+
+_PENDING, _IN_FLIGHT, _DONE, _DROPPED = range(4)
+
+
+class AdaptivePlanner:
+    def __init__(
+        self,
+        data_points,
+        k_nearest_neighbours,
+        algorithm=trim_extremities.get_query_points,
+        local_cells=True,
+        max_attempts=3,
+        **kwargs,
+    ):
+
+        # algorithm is any function taking coordinates and k which returns query
+        # points, used for the first plan with kwargs passed on to it
+        self.points = point_set.PointSet.from_data_points(data_points)
+        self.k_nearest_neighbours = min(k_nearest_neighbours, len(self.points))
+        self.local_cells = local_cells
+        self.max_attempts = max_attempts
+
+        n_points = len(self.points)
+        self.covered = np.zeros(n_points, dtype=bool)
+        self.missed = np.zeros(n_points, dtype=bool)
+        self.missing = np.zeros(n_points, dtype=bool)
+        self.given_up = np.zeros(n_points, dtype=int)
+        self.unknown = set()
+        self.n_mismatches = 0
+
+        self.query_points = np.zeros((0, 2))
+        self.predicted = np.zeros((0, self.k_nearest_neighbours), dtype=np.int32)
+        self.targets = np.zeros(0, dtype=int)
+        self.status = np.zeros(0, dtype=np.int8)
+        self.attempts = np.zeros(0, dtype=int)
+
+        query_points = algorithm(
+            self.points.coordinates, self.k_nearest_neighbours, **kwargs
+        )
+        self._add(np.asarray(query_points, dtype=float).reshape(-1, 2))
+
+    def _add(self, query_points, targets=None):
+        # targets are the points queried from their own location, -1 for the others
+        neighbours = self.points.tree.query(query_points, self.k_nearest_neighbours)[1]
+        if targets is None:
+            targets = np.full(len(query_points), -1)
+
+        self.query_points = np.concatenate([self.query_points, query_points])
+        self.predicted = np.concatenate(
+            [self.predicted, neighbours.reshape(-1, self.k_nearest_neighbours)]
+        )
+        self.targets = np.concatenate([self.targets, targets])
+        self.status = np.concatenate(
+            [self.status, np.full(len(query_points), _PENDING, dtype=np.int8)]
+        )
+        self.attempts = np.concatenate(
+            [self.attempts, np.zeros(len(query_points), dtype=int)]
+        )
+
+    @property
+    def done(self):
+        return not np.any((self.status == _PENDING) | (self.status == _IN_FLIGHT))
+
+    def next_wave(self, size=None):
+        # the ids and locations of up to size query points to run next
+        wave = np.flatnonzero(self.status == _PENDING)[:size]
+        self.status[wave] = _IN_FLIGHT
+
+        return wave, self.query_points[wave]
+
+    def _rows(self, returned_ids):
+        # the rows of the returned points in our copy, -1 for those not in it
+        if self.points.external_ids is None:
+            rows = np.asarray(returned_ids, dtype=int)
+            rows[(rows < 0) | (rows >= len(self.points))] = -1
+        else:
+            rows = self.points.external_ids.get_indexer(returned_ids)
+
+        self.unknown.update(np.asarray(returned_ids, dtype=object)[rows < 0].tolist())
+
+        return rows
+
+    def update(self, query_ids, returned):
+        # returned holds the ids of the points each query point returned, or None
+        # where the query failed, in which case it is run again unless it has failed
+        # max_attempts times
+        query_ids = np.asarray(query_ids, dtype=int)
+        failed = np.array([ids is None for ids in returned], dtype=bool)
+        self.attempts[query_ids[failed]] += 1
+        retry = failed & (self.attempts[query_ids] < self.max_attempts)
+        self.status[query_ids[retry]] = _PENDING
+
+        # the points a given up query point was to return are planned again
+        given_up = query_ids[failed & ~retry]
+        self.status[given_up] = _DROPPED
+        np.add.at(self.given_up, self.predicted[given_up].ravel(), 1)
+
+        answered = query_ids[~failed]
+        self.status[answered] = _DONE
+        returned = [ids for ids in returned if ids is not None]
+
+        # look up the whole wave at once, as rows of a table padded with -1
+        lengths = np.array([len(ids) for ids in returned], dtype=int)
+        rows = self._rows([point_id for ids in returned for point_id in ids])
+        table = np.full((len(returned), lengths.max(initial=0)), -1)
+        columns = np.arange(len(rows)) - np.repeat(
+            np.cumsum(lengths) - lengths, lengths
+        )
+        table[np.repeat(np.arange(len(returned)), lengths), columns] = rows
+        self.covered[rows[rows >= 0]] = True
+
+        # the predicted points each query point did not return
+        predicted = self.predicted[answered]
+        not_returned = ~np.any(
+            predicted[:, :, np.newaxis] == table[:, np.newaxis, :], axis=2
+        )
+        self.n_mismatches += int(np.count_nonzero(np.any(not_returned, axis=1)))
+        self.missed[predicted[not_returned]] = True
+
+        targets = self.targets[answered]
+        has_target = targets >= 0
+        self.missing[targets[has_target]] |= ~self.covered[targets[has_target]]
+
+        return self._replan()
+
+    def _replan(self):
+        # drop the query points to run whose points are all accounted for and add
+        # query points for the uncovered points which none of them will return.
+        # Returns the number of query points dropped and added
+        n_query_points = len(self.status)
+        settled = self.covered | self.missing | (self.given_up >= 2)
+        pending = np.flatnonzero(self.status == _PENDING)
+        dropped = pending[np.all(settled[self.predicted[pending]], axis=1)]
+        self.status[dropped] = _DROPPED
+
+        expected = np.zeros(len(self.points), dtype=bool)
+        running = (self.status == _PENDING) | (self.status == _IN_FLIGHT)
+        expected[self.predicted[running]] = True
+        expected[self.targets[running & (self.targets >= 0)]] = True
+
+        orphans = ~settled & ~expected
+        retarget = np.flatnonzero(orphans & self.missed)
+        if len(retarget) > 0:
+            self._add(self.points.coordinates[retarget], targets=retarget)
+
+        uncovered = np.flatnonzero(orphans & ~self.missed)
+        if len(uncovered) > 0:
+            self._add(
+                incremental_planner._local_plan(
+                    self.points.coordinates,
+                    self.points.tree,
+                    self.k_nearest_neighbours,
+                    uncovered,
+                    self.local_cells,
+                )
+            )
+
+        return {"dropped": len(dropped), "added": len(self.status) - n_query_points}
+
+    def report(self):
+        return {
+            "queries": int(np.count_nonzero(self.status == _DONE)),
+            "dropped": int(np.count_nonzero(self.status == _DROPPED)),
+            "failed": int(np.count_nonzero(self.attempts >= self.max_attempts)),
+            "covered": int(np.count_nonzero(self.covered)),
+            "missing": int(np.count_nonzero(self.missing)),
+            "uncovered": int(np.count_nonzero(~self.covered & ~self.missing)),
+            "unknown": len(self.unknown),
+            "mismatches": self.n_mismatches,
+        }
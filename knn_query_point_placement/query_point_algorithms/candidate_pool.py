@@ -0,0 +1,163 @@
+import os
+import sys
+import copy
+import numpy as np
+from scipy.sparse import csr_matrix
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(root_dir)
+from query_point_algorithms import instrumentation, nth_degree_voronoi, point_set
+
+
+# a pool of candidate query locations along with the data points each one returns,
+# found with one batched KDTree query. The data points are identified by their ids in
+# the PointSet, i.e. their rows. Coverage is available in the forms the solvers need:
+#   - neighbours, an array with the k nearest data points of each candidate as a row,
+#     which the set cover solvers accept as neighbour sets
+#   - coverage, a CSR matrix with a row per data point and a column per candidate
+#   - bitsets, each candidate's data points packed into bits, so unions of
+#     candidates are a bitwise or and counts are a popcount
+
+
+class CandidatePool:
+    def __init__(
+        self, data_points, k_nearest_neighbours, candidates, tree=None, workers=-1
+    ):
+
+        self.points = point_set.PointSet.from_data_points(data_points)
+        self.coordinates = self.points.coordinates
+        self.k_nearest_neighbours = min(k_nearest_neighbours, len(self.coordinates))
+        self.candidates = np.asarray(candidates, dtype=float).reshape(-1, 2)
+
+        if tree is None:
+            tree = self.points.tree
+        self.tree = tree
+
+        instrumentation.count("tree queries", len(self.candidates))
+        with instrumentation.stage("candidate pool queries"):
+            neighbours = tree.query(
+                self.candidates, self.k_nearest_neighbours, workers=workers
+            )[1]
+        self.neighbours = np.sort(neighbours.reshape(len(self.candidates), -1), axis=1)
+
+        self._bitsets = None
+
+    def __len__(self):
+        return len(self.candidates)
+
+    @property
+    def n_points(self):
+        return len(self.coordinates)
+
+    @property
+    def coverage(self):
+        # the transpose of the candidate by point matrix, whose rows are simply the
+        # rows of neighbours
+        candidate_by_point = csr_matrix(
+            (
+                np.ones(self.neighbours.size, dtype=bool),
+                self.neighbours.ravel(),
+                np.arange(0, self.neighbours.size + 1, self.neighbours.shape[1]),
+            ),
+            shape=(len(self), self.n_points),
+        )
+
+        return candidate_by_point.T.tocsr()
+
+    @property
+    def bitsets(self):
+        # one row of bytes per candidate, with the bits in the order of np.packbits
+        if self._bitsets is None:
+            n_bytes = (self.n_points + 7) // 8
+            bitsets = np.zeros((len(self), n_bytes), dtype=np.uint8)
+            rows = np.repeat(np.arange(len(self)), self.neighbours.shape[1])
+            columns = self.neighbours.ravel()
+            np.bitwise_or.at(
+                bitsets,
+                (rows, columns // 8),
+                (1 << (7 - columns % 8)).astype(np.uint8),
+            )
+            self._bitsets = bitsets
+
+        return self._bitsets
+
+    def covered(self, chosen):
+        # boolean array of the data points returned by the chosen candidates
+        union = np.bitwise_or.reduce(
+            self.bitsets[np.asarray(chosen, dtype=int)], axis=0
+        )
+
+        return np.unpackbits(union, count=self.n_points).astype(bool)
+
+    def coverage_counts(self, chosen=None):
+        # how many of the chosen candidates, by default all of them, return each point
+        if chosen is None:
+            return np.bincount(self.neighbours.ravel(), minlength=self.n_points)
+
+        return np.bincount(
+            self.neighbours[np.asarray(chosen, dtype=int)].ravel(),
+            minlength=self.n_points,
+        )
+
+    def subset(self, chosen):
+        # a pool of just the chosen candidates, sharing the tree
+        chosen = np.asarray(chosen, dtype=int)
+
+        pool = copy.copy(self)
+        pool.candidates = self.candidates[chosen]
+        pool.neighbours = self.neighbours[chosen]
+        if self._bitsets is not None:
+            pool._bitsets = self._bitsets[chosen]
+
+        return pool
+
+    def unique(self):
+        # a pool with one candidate for each distinct set of neighbours, keeping the
+        # first candidate to return it
+        first = np.unique(self.neighbours, axis=0, return_index=True)[1]
+
+        return self.subset(np.sort(first))
+
+    @classmethod
+    def from_data_points(cls, data_points, k_nearest_neighbours):
+        # query from every data point
+        points = point_set.PointSet.from_data_points(data_points)
+
+        return cls(points, k_nearest_neighbours, points.coordinates)
+
+    @classmethod
+    def from_grid(
+        cls, data_points, k_nearest_neighbours, x_bounds, y_bounds, size_of_grid
+    ):
+        x_grid = np.linspace(x_bounds[0], x_bounds[1], size_of_grid)
+        y_grid = np.linspace(y_bounds[0], y_bounds[1], size_of_grid)
+        grid = np.stack(np.meshgrid(x_grid, y_grid, indexing="ij"), axis=2)
+
+        return cls(data_points, k_nearest_neighbours, grid.reshape(-1, 2))
+
+    @classmethod
+    def from_random(
+        cls, data_points, k_nearest_neighbours, n_samples, x_bounds, y_bounds, seed=None
+    ):
+        # uniform random samples of the bounding box
+        rng = np.random.default_rng(seed)
+        candidates = np.column_stack(
+            [rng.uniform(*x_bounds, n_samples), rng.uniform(*y_bounds, n_samples)]
+        )
+
+        return cls(data_points, k_nearest_neighbours, candidates)
+
+    @classmethod
+    def from_voronoi(cls, data_points, k_nearest_neighbours, voronoi_cells=None):
+        # a viable point of every order k voronoi cell, which between them return every
+        # possible set of neighbours
+        if voronoi_cells is None:
+            voronoi_cells = nth_degree_voronoi.VoronoiCells(
+                data_points, nth_order=k_nearest_neighbours
+            )
+
+        candidates = [
+            point for point in voronoi_cells.find_viable_points() if point is not None
+        ]
+
+        return cls(data_points, k_nearest_neighbours, candidates)
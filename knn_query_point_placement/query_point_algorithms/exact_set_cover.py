@@ -0,0 +1,310 @@
+import os
+import sys
+import math
+import numpy as np
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(root_dir)
+from query_point_algorithms import greedy_set_cover, instrumentation
+
+
+# exact minimum set cover by branch and bound. Every neighbour set is stored as a
+# bitmask, a python int with bit i set if it covers data point i, so covering and
+# counting points are single integer operations. Before searching the problem is
+# reduced by two rules until neither applies:
+#   - a point which only one set covers forces that set to be chosen
+#   - a set whose uncovered points are a subset of another set's can be dropped
+# The search then splits the uncovered points into groups which share no sets and
+# solves each on its own, or otherwise branches on the sets covering the uncovered
+# point with the fewest good choices. Branches are pruned by lower bounds on the
+# number of sets still needed, and the search first looks for a cover the size of
+# the lower bound, then one bigger and so on, which prunes most branches at once.
+# Solved states are remembered as the same uncovered points are reached by choosing
+# sets in different orders. The greedy cover is the fallback if the search is
+# stopped early.
+
+
+def _popcount(mask):
+    return bin(mask).count("1")
+
+
+def _bits(mask):
+    # the indices of the set bits of mask
+    while mask:
+        lowest = mask & -mask
+        yield lowest.bit_length() - 1
+        mask ^= lowest
+
+
+def _to_array(mask, length):
+    # a boolean array with element i true if bit i of mask is set
+    n_bytes = max(mask.bit_length(), length) // 8 + 1
+    bits = np.unpackbits(
+        np.frombuffer(mask.to_bytes(n_bytes, "little"), dtype=np.uint8),
+        bitorder="little",
+    )
+
+    return bits[:length].astype(bool)
+
+
+def _to_masks(neighbour_sets):
+    masks = []
+    for neighbour_set in neighbour_sets:
+        mask = 0
+        for i in np.unique(neighbour_set).tolist():
+            mask |= 1 << i
+        masks.append(mask)
+
+    return masks
+
+
+def _point_to_sets(masks, set_ids, uncovered):
+    # for each uncovered point, the sets which cover it
+    point_sets = {i: [] for i in _bits(uncovered)}
+    for j in set_ids:
+        for i in _bits(masks[j] & uncovered):
+            point_sets[i].append(j)
+
+    return point_sets
+
+
+def _remove_dominated(masks, set_ids, uncovered):
+    # keep one of each group of identical sets and drop any set contained in another,
+    # comparing only the points which are still uncovered. A set can only contain
+    # another if they share the other's lowest point, so only those are compared
+    point_sets = _point_to_sets(masks, set_ids, uncovered)
+    by_size = sorted(set_ids, key=lambda j: -_popcount(masks[j] & uncovered))
+
+    kept = []
+    kept_masks = {}
+    for j in by_size:
+        mask = masks[j] & uncovered
+        if mask == 0:
+            continue
+
+        lowest = (mask & -mask).bit_length() - 1
+        if not any(
+            mask & kept_masks[other] == mask
+            for other in point_sets[lowest]
+            if other in kept_masks
+        ):
+            kept.append(j)
+            kept_masks[j] = mask
+
+    return kept
+
+
+def _packing_bound(uncovered, order, conflicts):
+    # greedily pick uncovered points no two of which are in the same set, each one
+    # needs a different set to cover it
+    available = uncovered
+    n_packed = 0
+    for i in order:
+        if available >> i & 1:
+            n_packed += 1
+            available &= ~conflicts[i]
+
+    return n_packed
+
+
+def _components(uncovered, conflicts):
+    # split the uncovered points into groups which share no sets
+    components = []
+    while uncovered:
+        lowest = (uncovered & -uncovered).bit_length() - 1
+        component = 1 << lowest
+        frontier = component
+        while frontier:
+            reached = 0
+            for i in _bits(frontier):
+                reached |= conflicts[i]
+            frontier = reached & uncovered & ~component
+            component |= frontier
+
+        components.append(component)
+        uncovered &= ~component
+
+    return components
+
+
+class _SearchStopped(Exception):
+    pass
+
+
+def _reduce(masks, set_ids, uncovered):
+    # apply the forced set and dominated set rules until neither changes anything
+    forced = []
+    while uncovered:
+        set_ids = _remove_dominated(masks, set_ids, uncovered)
+        point_sets = _point_to_sets(masks, set_ids, uncovered)
+
+        new_forced = {sets[0] for sets in point_sets.values() if len(sets) == 1}
+        if len(new_forced) == 0:
+            break
+
+        for j in new_forced:
+            uncovered &= ~masks[j]
+        forced += sorted(new_forced)
+        set_ids = [j for j in set_ids if j not in new_forced]
+
+    return forced, set_ids, uncovered
+
+
+def exact_set_cover(neighbour_sets, n_points, max_nodes=None):
+    # returns the indices of a minimum size cover and whether it is proven optimal,
+    # which it is unless the search was stopped after max_nodes branches
+    masks = _to_masks(neighbour_sets)
+    uncovered = (1 << int(n_points)) - 1
+
+    covered = 0
+    for mask in masks:
+        covered |= mask
+    if covered & uncovered != uncovered:
+        raise ValueError("Some points are not covered by any neighbour set")
+
+    forced, set_ids, uncovered = _reduce(masks, list(range(len(masks))), uncovered)
+    point_sets = _point_to_sets(masks, set_ids, uncovered)
+
+    # start from the greedy cover of whatever is left, with the uncovered points
+    # relabelled from 0
+    best = []
+    if uncovered:
+        points = list(_bits(uncovered))
+        relabel = np.full(n_points, -1)
+        relabel[points] = np.arange(len(points))
+        greedy = greedy_set_cover.greedy_set_cover(
+            [relabel[list(_bits(masks[j] & uncovered))] for j in set_ids], len(points)
+        )
+        best = [set_ids[j] for j in greedy.tolist()]
+
+    # the points each point shares a set with, and the points from hardest to cover
+    conflicts = {}
+    for i, sets in point_sets.items():
+        conflicts[i] = 0
+        for j in sets:
+            conflicts[i] |= masks[j]
+    order = sorted(point_sets, key=lambda i: len(point_sets[i]))
+
+    # the bounds are worked out with numpy. The sets are padded rows of point indices,
+    # with n_points standing for a point which is always covered, and the sets
+    # covering each point are listed point by point
+    set_position = {j: position for position, j in enumerate(set_ids)}
+    padded = greedy_set_cover._pad(
+        [list(_bits(masks[j] & uncovered)) for j in set_ids], n_points
+    )
+    points = np.array(sorted(point_sets))
+    sets_by_point = np.array(
+        [set_position[j] for i in points.tolist() for j in point_sets[i]], dtype=int
+    )
+    n_sets = np.array([len(point_sets[i]) for i in points.tolist()])
+    offsets = np.concatenate([[0], np.cumsum(n_sets)[:-1]])
+
+    # minimum covers of the uncovered states solved so far, and for the others the
+    # number of sets they are known to need at least
+    solved = {}
+    at_least = {}
+    n_nodes = 0
+
+    def lower_bound(uncovered):
+        # giving each uncovered point a weight of one over the largest gain of a set
+        # covering it, no set covers more than a total weight of one, so the total
+        # weight is a bound. So is the size of a packing of uncovered points no two
+        # of which share a set. Also returns the weight of the points each set covers
+        # and the point with the fewest sets of its largest gain covering it
+        is_uncovered = _to_array(uncovered, n_points + 1)
+        gains = np.count_nonzero(is_uncovered[padded], axis=1)
+        largest_gain = np.maximum.reduceat(gains[sets_by_point], offsets)
+
+        point_weights = np.zeros(n_points + 1)
+        point_weights[points] = np.where(
+            is_uncovered[points], 1 / np.maximum(largest_gain, 1), 0
+        )
+        weight = np.sum(point_weights)
+        bound = max(
+            math.ceil(weight - 1e-9),
+            _packing_bound(uncovered, order, conflicts),
+            at_least.get(uncovered, 0),
+        )
+
+        n_largest = np.add.reduceat(
+            gains[sets_by_point] == np.repeat(largest_gain, n_sets), offsets
+        )
+        hardest = points[np.argmin(np.where(is_uncovered[points], n_largest, np.inf))]
+
+        return bound, weight, np.sum(point_weights[padded], axis=1), hardest
+
+    def solve(uncovered, limit):
+        # a minimum cover of the uncovered points if it has fewer than limit sets,
+        # otherwise None
+        nonlocal n_nodes
+
+        if uncovered == 0:
+            return []
+
+        if uncovered in solved:
+            return solved[uncovered] if len(solved[uncovered]) < limit else None
+
+        bound, weight, set_weights, hardest = lower_bound(uncovered)
+        if bound >= limit:
+            return None
+
+        n_nodes += 1
+        if max_nodes is not None and n_nodes > max_nodes:
+            raise _SearchStopped
+
+        components = _components(uncovered, conflicts)
+        if len(components) > 1:
+            # no set covers points in two components, so each one is solved on its own
+            bounds = [lower_bound(component)[0] for component in components]
+            best = []
+            for c, component in enumerate(components):
+                cover = deepen(component, limit - len(best) - sum(bounds[c + 1 :]))
+                if cover is None:
+                    best = None
+                    break
+                best += cover
+        else:
+            # one of the sets covering the hardest point must be chosen. Choosing a set
+            # can only raise the weights of the points left, so a set whose points
+            # weigh too little to bring the bound under the limit is skipped
+            best = None
+            sets = point_sets[int(hardest)]
+            for j in sorted(sets, key=lambda j: -set_weights[set_position[j]]):
+                if 1 + math.ceil(weight - set_weights[set_position[j]] - 1e-9) >= limit:
+                    continue
+
+                cover = solve(uncovered & ~masks[j], limit - 1)
+                if cover is not None:
+                    best = [j] + cover
+                    limit = len(best)
+
+        if best is None:
+            at_least[uncovered] = limit
+        else:
+            solved[uncovered] = best
+
+        return best
+
+    def deepen(uncovered, limit):
+        # as solve, but first looking for a cover the size of the lower bound, then
+        # one bigger and so on. Tight limits prune most branches straight away, and
+        # the failed searches are remembered so they are cheap to repeat
+        if uncovered == 0:
+            return []
+
+        for tight_limit in range(lower_bound(uncovered)[0] + 1, limit + 1):
+            cover = solve(uncovered, tight_limit)
+            if cover is not None:
+                return cover
+
+        return None
+
+    try:
+        best = deepen(uncovered, len(best) + 1)
+        optimal = True
+    except _SearchStopped:
+        optimal = False
+
+    instrumentation.count("branch and bound nodes", n_nodes)
+
+    return np.array(sorted(forced + best), dtype=int), optimal
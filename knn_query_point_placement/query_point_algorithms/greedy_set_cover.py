@@ -0,0 +1,123 @@
+import os
+import sys
+import numpy as np
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(root_dir)
+from query_point_algorithms import candidate_pool, instrumentation
+
+
+# the greedy algorithm for set cover repeatedly picks the neighbour set covering the
+# most uncovered points. The number of uncovered points a set covers can only go down
+# as more sets are picked, so rather than rescanning every set each round we keep the
+# sets in a max priority queue of possibly stale gains. Gains are small integers, so
+# the queue is a list of buckets, one per gain. Only the top bucket is ever refreshed
+# against the coverage bitmap, in one vectorized pass, and a set is only picked once
+# its up to date gain is at least every other stale gain (lazy greedy / CELF).
+def _pad(neighbour_sets, n_points):
+    # store the sets as rows of one array, padded with n_points which is used as an
+    # index that is never uncovered
+    lengths = np.array([len(neighbour_set) for neighbour_set in neighbour_sets])
+    padded = np.full((len(neighbour_sets), max(lengths.max(initial=0), 1)), n_points)
+
+    for i, neighbour_set in enumerate(neighbour_sets):
+        padded[i, : lengths[i]] = neighbour_set
+
+    return padded
+
+
+@instrumentation.timed("greedy set cover")
+def greedy_set_cover(neighbour_sets, n_points, verbose=False):
+    # returns the indices of the chosen neighbour sets, where each neighbour set is an
+    # array of the indices of the points it covers
+    if isinstance(neighbour_sets, np.ndarray) and neighbour_sets.ndim == 2:
+        padded = neighbour_sets.astype(int)
+    else:
+        padded = _pad(neighbour_sets, n_points)
+
+    if np.min(np.bincount(padded.ravel(), minlength=n_points + 1)[:n_points]) == 0:
+        raise ValueError("Some points are not covered by any neighbour set")
+
+    uncovered = np.ones(n_points + 1, dtype=bool)
+    uncovered[n_points] = False
+    n_uncovered = n_points
+
+    # bucket every set by the number of points it covers
+    gains = np.count_nonzero(padded < n_points, axis=1)
+    buckets = [[] for _ in range(padded.shape[1] + 1)]
+    for gain in np.unique(gains):
+        buckets[gain].append(np.flatnonzero(gains == gain))
+
+    chosen = []
+    level = len(buckets) - 1
+    while n_uncovered > 0:
+        while len(buckets[level]) == 0:
+            level -= 1
+
+        # refresh the whole top bucket at once and move sets whose gain has dropped
+        ids = np.concatenate(buckets[level])
+        buckets[level] = []
+        gains = np.count_nonzero(uncovered[padded[ids]], axis=1)
+
+        for gain in np.unique(gains[gains < level]):
+            if gain > 0:
+                buckets[gain].append(ids[gains == gain])
+
+        # the rest cover level points each, which no other set can beat, so pick
+        # them in turn as long as picking the earlier ones leaves their gain alone.
+        # Checking a chunk at a time first drops most of those that lost out in one
+        # vectorized pass
+        tied = ids[gains == level]
+        dropped = []
+        for start in range(0, len(tied), 1024):
+            if n_uncovered == 0:
+                break
+
+            chunk = tied[start : start + 1024]
+            still_tied = np.count_nonzero(uncovered[padded[chunk]], axis=1) == level
+            dropped.append(chunk[~still_tied])
+
+            for i in chunk[still_tied].tolist():
+                if np.count_nonzero(uncovered[padded[i]]) == level:
+                    uncovered[padded[i]] = False
+                    n_uncovered -= level
+                    chosen.append(i)
+                else:
+                    dropped.append(np.array([i]))
+
+        # the sets which lost out are refreshed along with the rest of their
+        # new bucket when it reaches the top
+        buckets[level - 1].extend(dropped)
+
+        instrumentation.count("greedy bucket refreshes")
+        instrumentation.progress("greedy set cover", n_points - n_uncovered, n_points)
+        if verbose:
+            print(f"Found {n_points - n_uncovered} out of {n_points} points", end="\r")
+
+    if verbose:
+        print("\n")
+
+    return np.array(chosen, dtype=int)
+
+
+def candidate_neighbour_sets(data_points, k_nearest_neighbours, voronoi_cells=None):
+    # use a viable point of each order k voronoi cell as the candidate query points,
+    # each one returning its cell's set of neighbours as indices into data_points
+    pool = candidate_pool.CandidatePool.from_voronoi(
+        data_points, k_nearest_neighbours, voronoi_cells
+    )
+
+    return pool.candidates, pool.neighbours
+
+
+def get_query_points(
+    data_points, k_nearest_neighbours, voronoi_cells=None, verbose=False
+):
+
+    candidate_points, neighbour_sets = candidate_neighbour_sets(
+        data_points, k_nearest_neighbours, voronoi_cells
+    )
+
+    chosen = greedy_set_cover(neighbour_sets, len(data_points), verbose=verbose)
+
+    return candidate_points[chosen]
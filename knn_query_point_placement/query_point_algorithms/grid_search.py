@@ -1,76 +1,111 @@
-from scipy.spatial import KDTree
-import itertools
-import math
+import os
+import sys
 import numpy as np
 
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(root_dir)
+from query_point_algorithms import (
+    candidate_pool,
+    exact_set_cover,
+    instrumentation,
+    point_set,
+)
+
+
+def _grid_points(x_grid, y_grid, indices):
+    # the grid is ordered as the product of x_grid and y_grid, so rather than storing
+    # it the coordinates of a grid point are worked out from its index
+    return np.column_stack(
+        [x_grid[indices // len(y_grid)], y_grid[indices % len(y_grid)]]
+    )
 
-def get_query_points(
-    data_points, k_nearest_neighbours, x_bounds, y_bounds, size_of_grid_search
-):
 
-    # do some calculations to work out computational complexity
-    theoretical_min = math.ceil(len(data_points) / k_nearest_neighbours)
-    number_of_unique_neighbour_sets = math.comb(len(data_points), k_nearest_neighbours)
-    number_of_combinations_of_size_theoretical_min = math.comb(
-        number_of_unique_neighbour_sets, theoretical_min
+def _unique_neighbour_sets(
+    data_points, tree, k_nearest_neighbours, x_grid, y_grid, chunk_size, workers
+):
+    # query the grid in chunks of chunk_size points, so the whole grid is never held
+    # in memory at once. Each neighbour set is hashed by summing a random 64 bit
+    # number per data point, which does not depend on the order of the neighbours,
+    # and the sets are deduplicated on their hashes keeping the first grid point to
+    # find each one
+    weights = np.random.default_rng(0).integers(
+        0, np.iinfo(np.uint64).max, tree.n, dtype=np.uint64, endpoint=True
     )
 
-    assert (
-        number_of_combinations_of_size_theoretical_min < 10000
-    ), "Too many combinations to search, grid search not appropriate"
+    k_nearest_neighbours = min(k_nearest_neighbours, tree.n)
+    search_points = np.zeros((0, k_nearest_neighbours), dtype=int)
+    indices_of_search_points = np.zeros(0, dtype=int)
+    hashes = np.zeros(0, dtype=np.uint64)
+
+    n_grid_points = len(x_grid) * len(y_grid)
+    for start in range(0, n_grid_points, chunk_size):
+        indices = np.arange(start, min(start + chunk_size, n_grid_points))
+        neighbours = candidate_pool.CandidatePool(
+            data_points,
+            k_nearest_neighbours,
+            _grid_points(x_grid, y_grid, indices),
+            tree=tree,
+            workers=workers,
+        ).neighbours
+
+        hashes, first = np.unique(
+            np.concatenate([hashes, weights[neighbours].sum(axis=1)]),
+            return_index=True,
+        )
+        search_points = np.concatenate([search_points, neighbours])[first]
+        indices_of_search_points = np.concatenate([indices_of_search_points, indices])[
+            first
+        ]
+
+    # keep the order the neighbour sets were found in
+    order = np.argsort(indices_of_search_points)
+
+    return search_points[order], indices_of_search_points[order]
 
-    tree = KDTree(data_points.to_numpy())
+
+def get_query_points(
+    data_points,
+    k_nearest_neighbours,
+    x_bounds,
+    y_bounds,
+    size_of_grid_search,
+    chunk_size=250000,
+    workers=-1,
+    max_nodes=None,
+):
+
+    points = point_set.PointSet.from_data_points(data_points)
+    tree = points.tree
 
     # split the space into a grid
     x_grid = np.linspace(x_bounds[0], x_bounds[1], size_of_grid_search)
     y_grid = np.linspace(y_bounds[0], y_bounds[1], size_of_grid_search)
 
-    search_grid = itertools.product(x_grid, y_grid)
-
     print(
         "Iterating through grid of",
         len(x_grid) * len(y_grid),
         "points to find unique nearest neighbours",
     )
-    search_grid = np.array(list(itertools.product(x_grid, y_grid)))
-
-    # only keep unique points to save memory
-    search_points = []
-    indices_of_search_points = []
 
-    for i, (x_point, y_point) in enumerate(search_grid):
-        new_neighbours = tree.query([x_point, y_point], k_nearest_neighbours)[
-            1
-        ].tolist()
-        if new_neighbours not in search_points:
-            search_points += [new_neighbours]
-            indices_of_search_points += [i]
+    with instrumentation.stage("grid neighbour sets"):
+        search_points, indices_of_search_points = _unique_neighbour_sets(
+            points, tree, k_nearest_neighbours, x_grid, y_grid, chunk_size, workers
+        )
+    instrumentation.peak("unique neighbour sets", len(search_points))
 
     print("Found", len(search_points), "unique nearest neighbour sets")
 
-    search_points = np.array(search_points)
-    indices_of_search_points = np.array(indices_of_search_points)
-
-    # find the maximum number of points to cover the entire space
-    theoretical_max = len(data_points)
-
-    # now work our way through all combinations returning the search point
-    for i in range(theoretical_min, theoretical_max):
-        print("\n")
-        print("Searching solutions with", i, "search points")
-        number_of_combinations = math.comb(len(search_points), i)
-        for j, combination in enumerate(
-            itertools.combinations(enumerate(search_points), i)
-        ):
-            print("Checking combination", j, "of", number_of_combinations, end="\r")
-            indices_of_product = [i[0] for i in combination]
-            data_points_found = [i[1] for i in combination]
-            if len(set(np.concatenate(data_points_found))) == len(data_points):
-                print("\n")
-                print("Solution found, stopping")
-                best_solution_indices = indices_of_search_points[indices_of_product]
-                return search_grid[best_solution_indices, :]
-
-        print("\n")
-
-    return None
+    # find a minimum set of the neighbour sets covering every data point
+    with instrumentation.stage("grid combination search"):
+        best_solution, optimal = exact_set_cover.exact_set_cover(
+            search_points, len(points), max_nodes=max_nodes
+        )
+
+    if not optimal:
+        print(
+            "Search stopped after", max_nodes, "branches, solution may not be optimal"
+        )
+
+    print("Solution found with", len(best_solution), "search points")
+
+    return _grid_points(x_grid, y_grid, indices_of_search_points[best_solution])
@@ -0,0 +1,309 @@
+import os
+import sys
+import numpy as np
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(root_dir)
+from query_point_algorithms import instrumentation
+
+
+# batched, solver free feasibility checks for 2D systems of halfspaces Ax >= b. Each
+# system is intersected with a very large box by clipping a polygon against one
+# halfspace at a time, and all the systems are clipped together in one vectorized
+# pass. A system is feasible if what is left of the polygon has a positive area, in
+# which case the mean of its vertices is a point in its interior. This replaces
+# solving a linear program with pulp for every system. Tracking which halfspace each
+# edge of the polygon came from also gives the halfspaces which are not redundant.
+# The clipping is done relative to the centre of the bounds, and the areas compared
+# against a threshold relative to the size of the bounds, so that small cells of
+# tightly clustered coordinates far from the origin are still found.
+
+
+def _pad_systems(A_list, b_list):
+    # stack a list of systems with different numbers of constraints, padding with the
+    # constraint 0x >= -1 which every point satisfies
+    n_constraints = max([len(A) for A in A_list] + [1])
+
+    A = np.zeros((len(A_list), n_constraints, 2))
+    b = -np.ones((len(A_list), n_constraints))
+
+    for i, (A_i, b_i) in enumerate(zip(A_list, b_list)):
+        A[i, : len(A_i)] = np.reshape(A_i, (-1, 2))
+        b[i, : len(b_i)] = b_i
+
+    return A, b
+
+
+def _box_polygons(bounds, n_polygons):
+    # anticlockwise vertices of the bounding box, repeated for each system
+    (x_min, x_max), (y_min, y_max) = bounds
+    box = np.array([[x_min, y_min], [x_max, y_min], [x_max, y_max], [x_min, y_max]])
+
+    vertices = np.repeat(box[np.newaxis], n_polygons, axis=0)
+    n_vertices = np.full(n_polygons, 4)
+
+    return vertices, n_vertices
+
+
+def _default_bounds(A, b):
+    # the foot of the perpendicular from the origin to each constraint line, the box
+    # around these is a good place to look for interior points of the systems
+    norms = np.sum(A**2, axis=2)
+    real = norms > 0
+    feet = A[real] * (b[real] / norms[real])[:, np.newaxis]
+
+    if len(feet) == 0:
+        return np.array([[-1.0, 1.0], [-1.0, 1.0]])
+
+    lower = feet.min(axis=0)
+    upper = feet.max(axis=0)
+    margin = np.maximum(upper - lower, 1.0)
+
+    return np.column_stack([lower - margin, upper + margin])
+
+
+def _clip(vertices, n_vertices, a, c, edge_labels=None, labels=None):
+    # clip a batch of convex polygons, each against its own halfspace a.x >= c. The
+    # vertices are padded to the same length and n_vertices gives the number in use
+    n_polygons, max_vertices = vertices.shape[:2]
+    index = np.arange(max_vertices)
+    in_use = index[np.newaxis] < n_vertices[:, np.newaxis]
+
+    slack = np.einsum("pvd,pd->pv", vertices, a) - c[:, np.newaxis]
+    inside = (slack >= 0) | ~in_use
+
+    # polygons entirely inside the halfspace are left alone
+    changed = np.flatnonzero(~np.all(inside, axis=1))
+    if len(changed) == 0:
+        return vertices, n_vertices, edge_labels
+
+    rows = np.arange(len(changed))[:, np.newaxis]
+    in_use = in_use[changed]
+    slack = slack[changed]
+    inside = inside[changed]
+    changed_vertices = vertices[changed]
+    following = np.where(
+        index[np.newaxis] + 1 < n_vertices[changed][:, np.newaxis],
+        index[np.newaxis] + 1,
+        0,
+    )
+    next_vertices = changed_vertices[rows, following]
+    next_slack = slack[rows, following]
+    next_inside = next_slack >= 0
+
+    # Sutherland-Hodgman, every vertex inside is kept and every edge that crosses the
+    # line is replaced by the crossing point
+    crosses = in_use & (inside != next_inside)
+    t = slack / np.where(crosses, slack - next_slack, 1.0)
+    crossing = changed_vertices + t[:, :, np.newaxis] * (
+        next_vertices - changed_vertices
+    )
+
+    # scatter the kept vertices to the front of each row, keeping their order
+    keep = np.stack([in_use & inside, crosses], axis=2).reshape(len(changed), -1)
+    position = np.cumsum(keep, axis=1) - 1
+    kept_rows, kept_columns = np.nonzero(keep)
+
+    new_n_vertices = n_vertices.copy()
+    new_n_vertices[changed] = keep.sum(axis=1)
+    width = max(max_vertices, new_n_vertices.max())
+
+    new_vertices = np.zeros((n_polygons, width, 2))
+    new_vertices[:, :max_vertices] = vertices
+    new_vertices[changed] = 0
+    new_vertices[changed[kept_rows], position[kept_rows, kept_columns]] = np.stack(
+        [changed_vertices, crossing], axis=2
+    ).reshape(len(changed), -1, 2)[kept_rows, kept_columns]
+
+    if edge_labels is None:
+        return new_vertices, new_n_vertices, None
+
+    # a kept vertex starts the same edge as before. A crossing point starts an edge
+    # along the clipping line when leaving the halfspace, and otherwise starts the
+    # rest of the edge it was found on
+    changed_labels = edge_labels[changed]
+    candidate_labels = np.stack(
+        [
+            changed_labels,
+            np.where(inside, labels[changed][:, np.newaxis], changed_labels),
+        ],
+        axis=2,
+    ).reshape(len(changed), -1)
+
+    new_labels = np.full((n_polygons, width), -1)
+    new_labels[:, :max_vertices] = edge_labels
+    new_labels[
+        changed[kept_rows], position[kept_rows, kept_columns]
+    ] = candidate_labels[kept_rows, kept_columns]
+
+    return new_vertices, new_n_vertices, new_labels
+
+
+def clip_polygons(vertices, n_vertices, a, c):
+    vertices, n_vertices = _clip(vertices, n_vertices, a, c)[:2]
+
+    return vertices, n_vertices
+
+
+def clip_labelled_polygons(vertices, n_vertices, edge_labels, a, c, labels):
+    # as clip_polygons, but also track which halfspace each edge came from. The edge
+    # from vertex i to vertex i + 1 has label edge_labels[i], and edges created by
+    # clipping get the label of the halfspace they were clipped by
+    return _clip(vertices, n_vertices, a, c, edge_labels, labels)
+
+
+def intersect_halfspaces(A, b, bounds):
+    # intersect padded systems of halfspaces with the bounding box, returning the
+    # vertices of the resulting convex polygons
+    vertices, n_vertices = _box_polygons(bounds, len(A))
+
+    for j in range(A.shape[1]):
+        vertices, n_vertices = clip_polygons(vertices, n_vertices, A[:, j], b[:, j])
+
+    return vertices, n_vertices
+
+
+def polygon_areas(vertices, n_vertices):
+    # shoelace formula over the vertices in use
+    index = np.arange(vertices.shape[1])
+    in_use = index[np.newaxis] < n_vertices[:, np.newaxis]
+    following = np.where(
+        index[np.newaxis] + 1 < n_vertices[:, np.newaxis], index[np.newaxis] + 1, 0
+    )
+    next_vertices = np.take_along_axis(vertices, following[:, :, np.newaxis], axis=1)
+
+    # relative to the first vertex, which keeps the products small
+    first = vertices[:, :1]
+    vertices = vertices - first
+    next_vertices = next_vertices - first
+    cross = (
+        vertices[:, :, 0] * next_vertices[:, :, 1]
+        - next_vertices[:, :, 0] * vertices[:, :, 1]
+    )
+
+    return np.abs(np.sum(np.where(in_use, cross, 0), axis=1)) / 2
+
+
+def polygon_interior_points(vertices, n_vertices):
+    # any convex combination of all the vertices with positive weights lies in the
+    # interior of a polygon with positive area
+    in_use = np.arange(vertices.shape[1])[np.newaxis] < n_vertices[:, np.newaxis]
+    totals = np.sum(np.where(in_use[:, :, np.newaxis], vertices, 0), axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return totals / n_vertices[:, np.newaxis]
+
+
+def _outer_bounds(bounds):
+    # a box much larger than the bounds, so that cells which only start beyond the
+    # bounds, e.g. unbounded cells, are still found
+    centre = bounds.mean(axis=1)
+    half_width = 1e6 * np.max(bounds[:, 1] - bounds[:, 0])
+
+    return np.column_stack([centre - half_width, centre + half_width])
+
+
+def _to_centre(A, b, bounds):
+    # the systems and the bounds relative to the centre of the bounds, x = y + centre
+    centre = bounds.mean(axis=1)
+
+    return centre, b - A @ centre, bounds - centre[:, np.newaxis]
+
+
+def _area_threshold(bounds, min_area):
+    # min_area is relative to the square of the widest side of the bounds
+    return min_area * np.max(bounds[:, 1] - bounds[:, 0]) ** 2
+
+
+def reduce_systems(A_list, b_list, bounds=None, min_area=1e-12):
+    # drop the redundant halfspaces of each system Ax >= b, keeping only those along
+    # an edge of its polygon inside a box much larger than the bounds. Returns lists
+    # of the reduced A and b, None where the system has no interior, along with the
+    # polygons as padded vertices and the number of vertices of each
+    if len(A_list) == 0:
+        return [], [], np.zeros((0, 0, 2)), np.zeros(0, dtype=int)
+
+    instrumentation.count("halfspace systems", len(A_list))
+    A, b = _pad_systems(A_list, b_list)
+    instrumentation.peak("constraints per system", A.shape[1])
+
+    if bounds is None:
+        bounds = _default_bounds(A, b)
+    bounds = np.asarray(bounds, dtype=float)
+    centre, local_b, local_bounds = _to_centre(A, b, bounds)
+
+    # the edges of the box are labelled -1 and every other edge with its halfspace
+    vertices, n_vertices = _box_polygons(_outer_bounds(local_bounds), len(A))
+    edge_labels = np.full(vertices.shape[:2], -1)
+    for j in range(A.shape[1]):
+        vertices, n_vertices, edge_labels = clip_labelled_polygons(
+            vertices,
+            n_vertices,
+            edge_labels,
+            A[:, j],
+            local_b[:, j],
+            np.full(len(A), j),
+        )
+
+    feasible = polygon_areas(vertices, n_vertices) > _area_threshold(bounds, min_area)
+    in_use = np.arange(vertices.shape[1])[np.newaxis] < n_vertices[:, np.newaxis]
+    edge_labels = np.where(in_use, edge_labels, -1)
+
+    reduced_A = []
+    reduced_b = []
+    for i, labels in enumerate(edge_labels):
+        if not feasible[i]:
+            reduced_A.append(None)
+            reduced_b.append(None)
+            continue
+
+        kept = np.unique(labels[labels >= 0])
+        reduced_A.append(A[i, kept])
+        reduced_b.append(b[i, kept])
+
+    return reduced_A, reduced_b, vertices + centre, n_vertices
+
+
+def find_viable_points(A_list, b_list, bounds=None, min_area=1e-12):
+    # find a point in the interior of each system Ax >= b. Returns an array with one
+    # row per system, which is nan where the system has no interior.
+    if len(A_list) == 0:
+        return np.zeros((0, 2))
+
+    instrumentation.count("halfspace systems", len(A_list))
+    A, b = _pad_systems(A_list, b_list)
+    instrumentation.peak("constraints per system", A.shape[1])
+
+    if bounds is None:
+        bounds = _default_bounds(A, b)
+    bounds = np.asarray(bounds, dtype=float)
+    centre, b, local_bounds = _to_centre(A, b, bounds)
+    threshold = _area_threshold(bounds, min_area)
+
+    vertices, n_vertices = intersect_halfspaces(A, b, _outer_bounds(local_bounds))
+    feasible = polygon_areas(vertices, n_vertices) > threshold
+    points = polygon_interior_points(vertices, n_vertices)
+
+    # where possible prefer a point inside the bounds, which is cheap to find by
+    # clipping the polygons against the four sides of the bounds
+    for a, c in zip(
+        [[1, 0], [-1, 0], [0, 1], [0, -1]],
+        [
+            local_bounds[0, 0],
+            -local_bounds[0, 1],
+            local_bounds[1, 0],
+            -local_bounds[1, 1],
+        ],
+    ):
+        vertices, n_vertices = clip_polygons(
+            vertices,
+            n_vertices,
+            np.tile(np.array(a, dtype=float), (len(A), 1)),
+            np.full(len(A), c),
+        )
+
+    inside_bounds = polygon_areas(vertices, n_vertices) > threshold
+    points[inside_bounds] = polygon_interior_points(vertices, n_vertices)[inside_bounds]
+    points[~feasible] = np.nan
+
+    return points + centre
@@ -0,0 +1,249 @@
+import os
+import re
+import sys
+import math
+import time
+import tempfile
+import numpy as np
+import pulp
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(root_dir)
+from query_point_algorithms import greedy_set_cover, instrumentation
+
+
+# minimum set cover as one integer linear program. There is a binary variable x_j for
+# every candidate neighbour set, the objective is to minimise the sum of the x_j and
+# every data point must be in at least one chosen set. CBC is warm started from a
+# heuristic cover so that it always has an incumbent, and it can be stopped after a
+# time limit, in which case we also report how far the incumbent might be from the
+# optimum. The time limit covers building the model as well as solving it, and CBC
+# is given whatever is left. CBC counts time in cpu seconds, as with its elapsed time
+# mode it takes a much slower path through the root relaxation and overruns the limit.
+
+
+def _point_to_sets(neighbour_sets, n_points):
+    # for each point, the indices of the sets that cover it, in CSR form
+    lengths = np.array([len(neighbour_set) for neighbour_set in neighbour_sets])
+    members = np.concatenate([np.asarray(s, dtype=int) for s in neighbour_sets] + [[]])
+    members = members.astype(int)
+    set_ids = np.repeat(np.arange(len(neighbour_sets)), lengths)
+
+    order = np.argsort(members, kind="stable")
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(members, minlength=n_points))])
+
+    return set_ids[order], offsets
+
+
+def _read_log(log_path):
+    # the best bound CBC proved and the reason it stopped, or None for either if it
+    # did not print it. Every bound CBC prints is a valid lower bound: that of the
+    # root relaxation, those of the search and the one it reports when it stops
+    if not os.path.exists(log_path):
+        return None, None
+
+    with open(log_path) as f:
+        log = f.read()
+
+    number = r"([-0-9.eE+]+)"
+    bounds = [
+        float(bound)
+        for pattern in [
+            rf"Continuous objective value is {number}",
+            rf"best possible {number}",
+            rf"Lower bound:\s*{number}",
+        ]
+        for bound in re.findall(pattern, log)
+    ]
+    result = re.findall(r"Result - (.+)", log)
+
+    return (
+        max(bounds) if len(bounds) > 0 else None,
+        result[-1].strip() if len(result) > 0 else None,
+    )
+
+
+def _relaxation_bound(problem, solver_options):
+    # the linear programming relaxation is a bound, solved when CBC stopped before
+    # printing one
+    relaxed = problem.deepcopy()
+    for variable in relaxed.variables():
+        variable.cat = pulp.LpContinuous
+
+    instrumentation.count("cbc launches")
+    relaxed.solve(pulp.PULP_CBC_CMD(msg=False, timeMode="cpu", **solver_options))
+    if relaxed.status != pulp.LpStatusOptimal:
+        return None
+
+    return pulp.value(relaxed.objective)
+
+
+def _status(optimal, result, out_of_time):
+    # why the solve stopped, as CBC reports it in its log where it can
+    if optimal:
+        return "Optimal"
+    if out_of_time or (result is not None and "time" in result.lower()):
+        return "Stopped on time limit"
+    if result is not None:
+        return result
+
+    return "Not Solved"
+
+
+def _check_cover(solution, neighbour_sets, n_points):
+    # raise unless the sets with indices in solution cover every point
+    solution = np.asarray(solution, dtype=int).ravel()
+    if np.any((solution < 0) | (solution >= len(neighbour_sets))):
+        raise ValueError("The initial solution has indices of unknown neighbour sets")
+
+    members = np.concatenate([neighbour_sets[j] for j in solution] + [[]]).astype(int)
+    if np.any(np.bincount(members, minlength=n_points) == 0):
+        raise ValueError("The initial solution does not cover every point")
+
+
+def ilp_set_cover(
+    neighbour_sets,
+    n_points,
+    initial_solution=None,
+    time_limit=None,
+    threads=None,
+    verbose=False,
+):
+    # returns a dictionary with the indices of the chosen neighbour sets, the size of
+    # the cover (the incumbent), the best proven lower bound, the relative gap
+    # between them and why the solve stopped. initial_solution defaults to the
+    # greedy cover, and time_limit is in seconds from the call
+    start = time.perf_counter()
+    neighbour_sets = [np.asarray(s, dtype=int) for s in neighbour_sets]
+    set_ids, offsets = _point_to_sets(neighbour_sets, n_points)
+
+    if np.any(np.diff(offsets) == 0):
+        raise ValueError("Some points are not covered by any neighbour set")
+
+    if initial_solution is None:
+        initial_solution = greedy_set_cover.greedy_set_cover(neighbour_sets, n_points)
+    else:
+        _check_cover(initial_solution, neighbour_sets, n_points)
+    initial_solution = np.unique(np.asarray(initial_solution, dtype=int))
+
+    problem = pulp.LpProblem("set_cover", pulp.LpMinimize)
+    variables = [
+        pulp.LpVariable(f"x_{j}", cat=pulp.LpBinary) for j in range(len(neighbour_sets))
+    ]
+    problem += pulp.lpSum(variables)
+
+    for i in range(n_points):
+        problem += (
+            pulp.LpAffineExpression(
+                [(variables[j], 1) for j in set_ids[offsets[i] : offsets[i + 1]]]
+            )
+            >= 1,
+            f"cover_{i}",
+        )
+
+    # warm start from the heuristic solution
+    in_initial = np.zeros(len(neighbour_sets), dtype=bool)
+    in_initial[initial_solution] = True
+    for variable, value in zip(variables, in_initial):
+        variable.setInitialValue(int(value))
+
+    def remaining():
+        # the seconds left of time_limit, with at least one for CBC to read the model
+        return max(time_limit - (time.perf_counter() - start), 1.0)
+
+    solver_options = {}
+    if threads is not None:
+        solver_options["threads"] = threads
+
+    with tempfile.TemporaryDirectory() as directory:
+        log_path = os.path.join(directory, "cbc.log")
+        if time_limit is not None:
+            solver_options["timeLimit"] = remaining()
+        instrumentation.count("cbc launches")
+        with instrumentation.stage("ilp solve"):
+            problem.solve(
+                pulp.PULP_CBC_CMD(
+                    msg=False,
+                    warmStart=True,
+                    logPath=log_path,
+                    timeMode="cpu",
+                    **solver_options,
+                )
+            )
+        lower_bound, result = _read_log(log_path)
+
+        if verbose:
+            with open(log_path) as f:
+                print(f.read())
+
+    values = np.array([variable.varValue or 0 for variable in variables])
+    chosen = np.flatnonzero(values > 0.5)
+
+    # fall back on the warm start if CBC did not improve on it in time
+    found_cover = problem.sol_status in [
+        pulp.LpSolutionOptimal,
+        pulp.LpSolutionIntegerFeasible,
+    ]
+    if not found_cover or len(chosen) > len(initial_solution):
+        chosen = initial_solution
+
+    out_of_time = time_limit is not None and time.perf_counter() - start >= time_limit
+    if problem.sol_status == pulp.LpSolutionOptimal:
+        lower_bound = len(chosen)
+    elif lower_bound is None and not out_of_time:
+        if time_limit is not None:
+            solver_options["timeLimit"] = remaining()
+        lower_bound = _relaxation_bound(problem, solver_options)
+    if lower_bound is None:
+        # no query point returns more points than the largest set
+        largest = max(len(neighbour_set) for neighbour_set in neighbour_sets)
+        lower_bound = n_points / largest
+
+    # the objective is an integer so the bound can be rounded up
+    bound = min(math.ceil(lower_bound - 1e-6), len(chosen))
+    optimal = bound == len(chosen)
+
+    return {
+        "chosen": chosen,
+        "incumbent": len(chosen),
+        "bound": bound,
+        "gap": (len(chosen) - bound) / max(len(chosen), 1),
+        "optimal": optimal,
+        "status": _status(optimal, result, out_of_time),
+    }
+
+
+def get_query_points(
+    data_points,
+    k_nearest_neighbours,
+    voronoi_cells=None,
+    time_limit=60,
+    threads=None,
+    verbose=False,
+    return_report=False,
+):
+
+    candidate_points, neighbour_sets = greedy_set_cover.candidate_neighbour_sets(
+        data_points, k_nearest_neighbours, voronoi_cells
+    )
+
+    report = ilp_set_cover(
+        neighbour_sets,
+        len(data_points),
+        time_limit=time_limit,
+        threads=threads,
+        verbose=verbose,
+    )
+
+    if verbose:
+        print(
+            f"Incumbent {report['incumbent']}, bound {report['bound']}, "
+            f"gap {100 * report['gap']:.1f}%"
+        )
+
+    query_points = candidate_points[report["chosen"]]
+
+    if return_report:
+        return query_points, report
+
+    return query_points
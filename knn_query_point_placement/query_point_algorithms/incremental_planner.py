@@ -0,0 +1,272 @@
+import os
+import sys
+import numpy as np
+from scipy.spatial import KDTree
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(root_dir)
+from query_point_algorithms import (
+    candidate_pool,
+    greedy_set_cover,
+    point_set,
+    trim_extremities,
+)
+
+
+# keep a query plan up to date as data points are added and removed, without planning
+# from scratch. Every query point keeps the points it returns and the distance to the
+# furthest of them. A query point is only affected by a new point closer than that
+# distance, or by the removal of one of the points it returns, so only the affected
+# query points are queried again. The points no query point returns any more are then
+# covered by a local plan: the candidates are the uncovered points themselves and a
+# viable point of every order k voronoi cell of the points around them, and the
+# fewest candidates covering the uncovered points are picked greedily. Affected query
+# points whose points are all returned by others are dropped. Query points have
+# stable ids, and those added or returning different points since the last call to
+# mark_queried are the only ones which need querying again.
+
+
+def _local_plan(coordinates, tree, k_nearest_neighbours, uncovered, local_cells=True):
+    # query points covering the uncovered rows of coordinates, from candidates near
+    # them. tree is a KDTree over the coordinates
+    candidates = [coordinates[uncovered]]
+
+    if local_cells:
+        # the points within twice the reach of the uncovered points' neighbours
+        distances = tree.query(coordinates[uncovered], k_nearest_neighbours)[0]
+        reach = 2 * distances.reshape(len(uncovered), -1)[:, -1]
+        nearby = np.unique(
+            np.concatenate(
+                [
+                    np.asarray(rows, dtype=int)
+                    for rows in tree.query_ball_point(coordinates[uncovered], reach)
+                ]
+            )
+        )
+        if len(nearby) > k_nearest_neighbours:
+            pool = candidate_pool.CandidatePool.from_voronoi(
+                coordinates[nearby], k_nearest_neighbours
+            )
+            candidates.append(pool.candidates)
+
+    candidates = np.concatenate(candidates)
+    neighbours = tree.query(candidates, k_nearest_neighbours)[1]
+    neighbours = neighbours.reshape(len(candidates), -1)
+
+    # the set cover is only over the uncovered points, relabelled from 0
+    relabel = np.full(len(coordinates), -1)
+    relabel[uncovered] = np.arange(len(uncovered))
+    neighbour_sets = [row[row >= 0] for row in relabel[neighbours]]
+
+    chosen = greedy_set_cover.greedy_set_cover(neighbour_sets, len(uncovered))
+
+    return candidates[chosen]
+
+
+def _concatenate_ids(ids, new_ids):
+    # numpy would turn integer ids into strings alongside string ids, so ids of
+    # different kinds are kept as objects
+    kinds = {ids.dtype.kind, new_ids.dtype.kind}
+    if len(kinds) > 1 and not kinds <= set("iu"):
+        ids, new_ids = ids.astype(object), new_ids.astype(object)
+
+    return np.concatenate([ids, new_ids])
+
+
+class IncrementalPlanner:
+    def __init__(
+        self,
+        data_points,
+        k_nearest_neighbours,
+        algorithm=trim_extremities.get_query_points,
+        local_cells=True,
+        **kwargs,
+    ):
+
+        # algorithm is any function taking coordinates and k which returns query
+        # points, used once for the first plan with kwargs passed on to it. Points are
+        # identified by their external ids, or by their rows to begin with if they
+        # have none
+        points = point_set.PointSet.from_data_points(data_points)
+        self.coordinates = points.coordinates
+        self.ids = np.asarray(points.to_external(points.ids))
+        self._next_point_id = 0
+        self._count_ids(self.ids)
+        self.k_nearest_neighbours = k_nearest_neighbours
+        self.local_cells = local_cells
+        self.tree = KDTree(self.coordinates)
+
+        query_points = np.asarray(
+            algorithm(self.coordinates, self._k, **kwargs), dtype=float
+        ).reshape(-1, 2)
+
+        self.query_points = np.zeros((0, 2))
+        self.query_ids = np.zeros(0, dtype=int)
+        self.neighbours = np.zeros((0, self._k), dtype=np.int32)
+        self.radii = np.zeros(0)
+        self._next_query_id = 0
+
+        self.stale = set(self._append_query_points(query_points).tolist())
+
+    @property
+    def _k(self):
+        return min(self.k_nearest_neighbours, len(self.coordinates))
+
+    def _query(self, locations):
+        # the rows of the points each location returns and the distance to the
+        # furthest one
+        distances, neighbours = self.tree.query(locations, self._k)
+        neighbours = neighbours.reshape(len(locations), -1).astype(np.int32)
+        distances = distances.reshape(len(locations), -1)
+
+        return neighbours, distances[:, -1]
+
+    def _append_query_points(self, query_points):
+        neighbours, radii = self._query(query_points)
+        query_ids = np.arange(len(query_points)) + self._next_query_id
+        self._next_query_id += len(query_points)
+
+        self.query_points = np.concatenate([self.query_points, query_points])
+        self.query_ids = np.concatenate([self.query_ids, query_ids])
+        self.neighbours = np.concatenate([self.neighbours, neighbours])
+        self.radii = np.concatenate([self.radii, radii])
+
+        return query_ids
+
+    def _rows(self, ids):
+        position = {point_id: row for row, point_id in enumerate(self.ids.tolist())}
+        try:
+            rows = [position[i] for i in np.asarray(ids, dtype=object).tolist()]
+            return np.array(rows, dtype=int)
+        except KeyError:
+            raise KeyError("Some ids are not in the planner")
+
+    def _count_ids(self, ids):
+        # keep the default ids after every integer id so far
+        if ids.dtype.kind in "iu" and len(ids) > 0:
+            self._next_point_id = max(self._next_point_id, int(ids.max()) + 1)
+
+    def add_points(self, data_points, ids=None):
+        # data_points is a DataFrame or an array of coordinates, as for the first
+        # plan. ids default to the DataFrame's index unless it is just the row
+        # numbers, and otherwise to the integers after the largest integer id so far
+        points = point_set.PointSet.from_data_points(data_points)
+        coordinates = points.coordinates
+        if ids is None and points.external_ids is not None:
+            ids = points.external_ids
+        if ids is None:
+            ids = np.arange(len(coordinates)) + self._next_point_id
+        ids = np.asarray(ids)
+        if len(ids) != len(coordinates):
+            raise ValueError("Need one id for each point")
+
+        # a query point only returns a new point if it is nearer than the furthest
+        # point it returns now
+        distances = KDTree(coordinates).query(self.query_points, 1)[0]
+        affected = np.flatnonzero(distances <= self.radii)
+
+        self.coordinates = np.concatenate([self.coordinates, coordinates])
+        self.ids = _concatenate_ids(self.ids, ids)
+        self._count_ids(ids)
+        self.tree = KDTree(self.coordinates)
+
+        return self._repair(affected)
+
+    def remove_points(self, ids):
+        rows = self._rows(ids)
+        removed = np.zeros(len(self.coordinates), dtype=bool)
+        removed[rows] = True
+
+        affected = np.flatnonzero(np.any(removed[self.neighbours], axis=1))
+
+        # the rows of the points after the removed ones move down, and the affected
+        # query points are about to be queried again so their rows do not matter
+        new_rows = np.cumsum(~removed) - 1
+        self.neighbours = np.where(
+            removed[self.neighbours], 0, new_rows[self.neighbours]
+        ).astype(np.int32)
+
+        self.coordinates = self.coordinates[~removed]
+        self.ids = self.ids[~removed]
+        self.tree = KDTree(self.coordinates)
+
+        return self._repair(affected)
+
+    def _repair(self, affected):
+        # query the affected query points again, cover what is left uncovered and
+        # drop the affected query points which are no longer needed. Returns the ids
+        # of the query points added, removed and returning different points
+        old_neighbours = np.sort(self.neighbours[affected], axis=1)
+        if self.neighbours.shape[1] != self._k:
+            # with fewer than k points every query point returns all of them, so
+            # they are all affected when the number of points crosses k
+            affected = np.arange(len(self.query_points))
+            old_neighbours = np.sort(self.neighbours, axis=1)
+            self.neighbours = np.zeros((len(self.query_points), self._k), np.int32)
+        neighbours, radii = self._query(self.query_points[affected])
+        self.neighbours[affected] = neighbours
+        self.radii[affected] = radii
+
+        is_changed = np.ones(len(affected), dtype=bool)
+        if old_neighbours.shape == neighbours.shape:
+            is_changed = np.any(old_neighbours != np.sort(neighbours, axis=1), axis=1)
+        changed = self.query_ids[affected[is_changed]]
+
+        counts = np.bincount(self.neighbours.ravel(), minlength=len(self.coordinates))
+        uncovered = np.flatnonzero(counts == 0)
+        added = np.zeros(0, dtype=int)
+        if len(uncovered) > 0:
+            local_plan = _local_plan(
+                self.coordinates, self.tree, self._k, uncovered, self.local_cells
+            )
+            added = self._append_query_points(local_plan)
+            counts += np.bincount(
+                self.neighbours[-len(added) :].ravel(), minlength=len(counts)
+            )
+
+        # drop affected query points whose points are all returned by others
+        keep = np.ones(len(self.query_points), dtype=bool)
+        for i in affected.tolist():
+            if np.all(counts[self.neighbours[i]] > 1):
+                counts[self.neighbours[i]] -= 1
+                keep[i] = False
+        removed = self.query_ids[~keep]
+
+        self.query_points = self.query_points[keep]
+        self.query_ids = self.query_ids[keep]
+        self.neighbours = self.neighbours[keep]
+        self.radii = self.radii[keep]
+
+        changed = np.setdiff1d(changed, removed)
+        self.stale.difference_update(removed.tolist())
+        self.stale.update(added.tolist() + changed.tolist())
+
+        return {"added": added, "removed": removed, "changed": changed}
+
+    def to_query(self):
+        # the ids and locations of the query points added or changed since they were
+        # last marked as queried
+        is_stale = np.isin(self.query_ids, list(self.stale))
+
+        return self.query_ids[is_stale], self.query_points[is_stale]
+
+    def mark_queried(self, query_ids=None):
+        # by default every query point
+        if query_ids is None:
+            self.stale = set()
+        else:
+            self.stale.difference_update(np.asarray(query_ids).tolist())
+
+    def returned(self, query_ids=None):
+        # the ids of the points each query point returns
+        if query_ids is None:
+            return self.ids[self.neighbours]
+
+        position = np.searchsorted(self.query_ids, query_ids)
+        return self.ids[self.neighbours[position]]
+
+    def covers_all(self):
+        covered = np.zeros(len(self.coordinates), dtype=bool)
+        covered[self.neighbours] = True
+
+        return bool(np.all(covered))
@@ -0,0 +1,129 @@
+import json
+import time
+import functools
+import contextlib
+
+
+# a lightweight record of where the time goes. The algorithms and the voronoi
+# pipeline report into whichever Recorder is active:
+#   - stage(name), a context manager timing a stage and counting how often it runs
+#   - count(name, n), adding n to a counter, e.g. LP solves or KDTree queries
+#   - peak(name, value), keeping the largest value seen, e.g. the number of cells
+#   - progress(name, done, total), passed on to the recorder's callback only
+#   - timed(name), a decorator running a whole function as a stage
+# A Recorder is made active with `with instrumentation.record() as recorder:`, and its
+# callback, if it has one, is called with every event as (kind, name, value). With no
+# recorder active every call returns straight away, so the reports cost next to
+# nothing. Work done in other processes, e.g. in a process pool, is not recorded.
+
+
+class Recorder:
+    def __init__(self, callback=None):
+
+        self.callback = callback
+        self.timings = {}
+        self.counters = {}
+        self.peaks = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            total, calls = self.timings.get(name, (0.0, 0))
+            self.timings[name] = (total + seconds, calls + 1)
+            if self.callback is not None:
+                self.callback("stage", name, seconds)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+        if self.callback is not None:
+            self.callback("count", name, n)
+
+    def peak(self, name, value):
+        self.peaks[name] = max(self.peaks.get(name, value), value)
+        if self.callback is not None:
+            self.callback("peak", name, value)
+
+    def progress(self, name, done, total):
+        if self.callback is not None:
+            self.callback("progress", name, (done, total))
+
+    def to_dict(self):
+        return {
+            "timings": {
+                name: {"seconds": seconds, "calls": calls}
+                for name, (seconds, calls) in self.timings.items()
+            },
+            "counters": dict(self.counters),
+            "peaks": dict(self.peaks),
+        }
+
+    def to_json(self, path=None, **kwargs):
+        # the record as a JSON string, also written to path if there is one
+        text = json.dumps(self.to_dict(), indent=4, **kwargs)
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(text)
+
+        return text
+
+
+_active = None
+_no_stage = contextlib.nullcontext()
+
+
+@contextlib.contextmanager
+def record(recorder=None, callback=None):
+    # make a recorder active for the duration of the block, restoring whichever was
+    # active before
+    global _active
+
+    if recorder is None:
+        recorder = Recorder(callback=callback)
+
+    previous = _active
+    _active = recorder
+    try:
+        yield recorder
+    finally:
+        _active = previous
+
+
+def stage(name):
+    if _active is None:
+        return _no_stage
+
+    return _active.stage(name)
+
+
+def count(name, n=1):
+    if _active is not None:
+        _active.count(name, n)
+
+
+def peak(name, value):
+    if _active is not None:
+        _active.peak(name, value)
+
+
+def progress(name, done, total):
+    if _active is not None:
+        _active.progress(name, done, total)
+
+
+def timed(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return function(*args, **kwargs)
+
+            with _active.stage(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,210 @@
+import os
+import sys
+import time
+import numpy as np
+from scipy.spatial import KDTree
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(root_dir)
+from query_point_algorithms import instrumentation, point_set
+
+
+# shrink the plan of any algorithm after it is built. First every query point whose
+# neighbours are all returned by other query points is removed, using how many query
+# points return each data point. Then until the time limit, pairs of nearby query
+# points are replaced by a single candidate which returns every point that only the
+# pair returns. The candidates of a pair are tried in rounds: the centroid of the
+# points only the pair returns, the midpoint of the pair, then random points in the
+# box around those points. Every round tests all the pairs in one batched KDTree query
+# and vectorized containment check, and the valid swaps are then applied one by one
+# as long as they are still valid.
+
+
+def remove_redundant(neighbours, n_points, counts=None):
+    # drop query points all of whose neighbours are returned by another query point,
+    # trying those returning the fewest points no other query point returns first.
+    # neighbours has a row of data point ids for each query point. Returns a boolean
+    # array of the query points kept
+    if counts is None:
+        counts = np.bincount(neighbours.ravel(), minlength=n_points)
+    unique = np.count_nonzero(counts[neighbours] == 1, axis=1)
+
+    kept = np.ones(len(neighbours), dtype=bool)
+    for i in np.argsort(unique, kind="stable").tolist():
+        if np.all(counts[neighbours[i]] > 1):
+            counts[neighbours[i]] -= 1
+            kept[i] = False
+
+    return kept
+
+
+def _pairs(query_points, kept, n_partners):
+    # each kept query point with its n_partners nearest kept query points, once each
+    ids = np.flatnonzero(kept)
+    n_partners = min(n_partners, len(ids) - 1)
+    if n_partners < 1:
+        return np.zeros((0, 2), dtype=int)
+
+    partners = KDTree(query_points[ids]).query(query_points[ids], n_partners + 1)[1]
+    pairs = np.column_stack([np.repeat(ids, n_partners), ids[partners[:, 1:]].ravel()])
+    pairs = np.unique(np.sort(pairs, axis=1), axis=0)
+
+    return pairs[pairs[:, 0] != pairs[:, 1]]
+
+
+def _only_returned_by_pair(neighbours, counts, pairs):
+    # for each pair, a mask over the 2k neighbours of the pair, first those of the
+    # first query point and then the second's, of the points no other query point
+    # returns. A point both return is only counted once, from the first
+    first = neighbours[pairs[:, 0]]
+    second = neighbours[pairs[:, 1]]
+    in_both = first[:, :, np.newaxis] == second[:, np.newaxis, :]
+
+    only_first = counts[first] - 1 - np.any(in_both, axis=2) == 0
+    only_second = (counts[second] - 1 == 0) & ~np.any(in_both, axis=1)
+
+    return np.concatenate([first, second], axis=1), np.concatenate(
+        [only_first, only_second], axis=1
+    )
+
+
+def _candidates(coordinates, members, needed, pair_points, attempt, rng):
+    # one candidate location for each pair
+    if attempt == 1:
+        return pair_points.mean(axis=1)
+
+    points = coordinates[members]
+    weights = needed[:, :, np.newaxis]
+    n_needed = np.maximum(needed.sum(axis=1), 1)[:, np.newaxis]
+
+    if attempt == 0:
+        return np.sum(points * weights, axis=1) / n_needed
+
+    lower = np.where(weights, points, np.inf).min(axis=1)
+    upper = np.where(weights, points, -np.inf).max(axis=1)
+    lower = np.where(np.isfinite(lower), lower, 0)
+    upper = np.where(np.isfinite(upper), upper, 0)
+
+    return lower + rng.uniform(size=lower.shape) * (upper - lower)
+
+
+@instrumentation.timed("local search")
+def improve(
+    data_points,
+    k_nearest_neighbours,
+    query_points,
+    time_limit=10.0,
+    n_partners=4,
+    max_rounds=20,
+    seed=None,
+    verbose=False,
+):
+    # returns the improved query points and a report of how many query points were
+    # removed as redundant, how many swaps were made and how many queries are saved
+    start = time.perf_counter()
+    points = point_set.PointSet.from_data_points(data_points)
+    k_nearest_neighbours = min(k_nearest_neighbours, len(points))
+    tree = points.tree
+    rng = np.random.default_rng(seed)
+
+    def neighbours_of(locations):
+        neighbours = tree.query(locations, k_nearest_neighbours)[1]
+        return neighbours.reshape(len(locations), -1)
+
+    query_points = np.asarray(query_points, dtype=float).reshape(-1, 2)
+    n_initial = len(query_points)
+    neighbours = neighbours_of(query_points)
+    counts = np.bincount(neighbours.ravel(), minlength=len(points))
+    if np.any(counts == 0):
+        raise ValueError("The plan does not return every point")
+
+    kept = remove_redundant(neighbours, len(points), counts)
+    n_redundant = int(np.count_nonzero(~kept))
+
+    n_swaps = 0
+    for attempt in range(max_rounds):
+        if time.perf_counter() - start > time_limit:
+            break
+
+        pairs = _pairs(query_points, kept, n_partners)
+        if len(pairs) == 0:
+            break
+
+        members, needed = _only_returned_by_pair(neighbours, counts, pairs)
+        candidates = _candidates(
+            points.coordinates, members, needed, query_points[pairs], attempt, rng
+        )
+        candidate_neighbours = neighbours_of(candidates)
+
+        # a candidate is valid if it returns every point only the pair returns
+        returned = np.any(
+            members[:, :, np.newaxis] == candidate_neighbours[:, np.newaxis, :], axis=2
+        )
+        valid = np.flatnonzero(np.all(returned | ~needed, axis=1))
+
+        new_query_points = []
+        for i in valid.tolist():
+            first, second = pairs[i]
+            if not kept[first] or not kept[second]:
+                continue
+
+            # check again with the counts after the swaps made so far
+            counts[neighbours[first]] -= 1
+            counts[neighbours[second]] -= 1
+            counts[candidate_neighbours[i]] += 1
+            if np.any(counts[neighbours[first]] == 0) or np.any(
+                counts[neighbours[second]] == 0
+            ):
+                counts[neighbours[first]] += 1
+                counts[neighbours[second]] += 1
+                counts[candidate_neighbours[i]] -= 1
+                continue
+
+            kept[first] = kept[second] = False
+            new_query_points.append(i)
+
+        n_swaps += len(new_query_points)
+        instrumentation.count("swaps tried", len(pairs))
+        instrumentation.count("swaps made", len(new_query_points))
+        query_points = np.concatenate([query_points, candidates[new_query_points]])
+        neighbours = np.concatenate(
+            [neighbours, candidate_neighbours[new_query_points]]
+        )
+        kept = np.concatenate([kept, np.ones(len(new_query_points), dtype=bool)])
+
+        if verbose:
+            print(
+                f"Round {attempt + 1}: {len(valid)} possible swaps, made "
+                f"{len(new_query_points)}, {np.count_nonzero(kept)} query points",
+                end="\r",
+            )
+
+    if verbose:
+        print("\n")
+
+    # a swap can leave other query points redundant
+    n_kept = np.count_nonzero(kept)
+    kept[kept] = remove_redundant(neighbours[kept], len(points))
+    n_redundant += int(n_kept - np.count_nonzero(kept))
+
+    n_final = int(np.count_nonzero(kept))
+    return query_points[kept], {
+        "initial": n_initial,
+        "final": n_final,
+        "redundant": n_redundant,
+        "swaps": n_swaps,
+        "saved": n_initial - n_final,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def get_query_points(
+    data_points, k_nearest_neighbours, algorithm, time_limit=10.0, seed=None, **kwargs
+):
+    # run algorithm, any function taking data points and k with kwargs passed on to
+    # it, and improve its plan
+    query_points = algorithm(data_points, k_nearest_neighbours, **kwargs)
+
+    return improve(
+        data_points, k_nearest_neighbours, query_points, time_limit, seed=seed
+    )[0]
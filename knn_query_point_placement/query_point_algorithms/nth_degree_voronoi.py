@@ -4,52 +4,88 @@ import os
 import sys
 import pulp
 from pulp import LpProblem, LpVariable
-from scipy.spatial import Voronoi
+from scipy.spatial import Delaunay, KDTree, QhullError, Voronoi
 import matplotlib.pyplot as plt
 
 root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 sys.path.append(root_dir)
 from query_point_algorithms import nth_degree_voronoi
+from query_point_algorithms import halfspace_intersection
+from query_point_algorithms import instrumentation
+from query_point_algorithms import order_k_voronoi
+from query_point_algorithms import point_set
+from query_point_algorithms import voronoi_cache
 import knn_plotting as plot
 
 
 # functions to extract information from scipy.spatial.Voronoi on individual cells
 # we will then create objects to represent these cells.
-def _extract_cell_information(vor_output, data_point_index):
+def _build_ridge_index(vor_output):
+
+    # group the ridges by the data points either side of them in one pass, so each
+    # cell can look up its own ridges rather than scanning all of them
+    ridge_points = np.asarray(vor_output.ridge_points)
+    ridge_vertices = np.asarray(vor_output.ridge_vertices)
+
+    # interleave the two sides of each ridge and sort stably, so every point's
+    # ridges stay in the order scipy returned them
+    point_of_entry = ridge_points.ravel()
+    ridge_of_entry = np.repeat(np.arange(len(ridge_points)), 2)
+    order = np.argsort(point_of_entry, kind="stable")
+
+    is_finite = np.all(ridge_vertices >= 0, axis=1)
+
+    return {
+        "ridges": ridge_of_entry[order],
+        "offsets": np.searchsorted(
+            point_of_entry[order], np.arange(len(vor_output.points) + 1)
+        ),
+        "is_finite": is_finite,
+        # the vertices of the finite ridges, infinite ridges are ignored here
+        "segments": vor_output.vertices[ridge_vertices],
+        # the finite end of the infinite ridges, and the tangent between the points
+        "finite_vertices": vor_output.vertices[ridge_vertices.max(axis=1)],
+        "directions": vor_output.points[ridge_points[:, 1]]
+        - vor_output.points[ridge_points[:, 0]],
+    }
+
+
+def _extract_cell_information(vor_output, data_point_index, ridge_index=None):
 
     # copy and adapt code from voronoi_plot_2d to extract info on the cells
     # into an easier to use format
-    out_dict = {
-        "finite_segments": [],
-        "infinite_segments": [],
+    if ridge_index is None:
+        ridge_index = _build_ridge_index(vor_output)
+
+    ridges = ridge_index["ridges"][
+        ridge_index["offsets"][data_point_index] : ridge_index["offsets"][
+            data_point_index + 1
+        ]
+    ]
+    finite_ridges = ridges[ridge_index["is_finite"][ridges]]
+    infinite_ridges = ridges[~ridge_index["is_finite"][ridges]]
+
+    return {
+        "finite_segments": list(ridge_index["segments"][finite_ridges]),
+        "infinite_segments": [
+            {"vertex": vertex, "direction": direction}
+            for vertex, direction in zip(
+                ridge_index["finite_vertices"][infinite_ridges],
+                ridge_index["directions"][infinite_ridges],
+            )
+        ],
         "closest_data_points": [vor_output.points[data_point_index]],
     }
 
-    for pointidx, simplex in zip(vor_output.ridge_points, vor_output.ridge_vertices):
-        if data_point_index in pointidx:
-            simplex = np.asarray(simplex)
-            if np.all(simplex >= 0):
-                out_dict["finite_segments"].append(vor_output.vertices[simplex])
-            else:
-                i = simplex[simplex >= 0][0]  # finite end Voronoi vertex
-
-                t = (
-                    vor_output.points[pointidx[1]] - vor_output.points[pointidx[0]]
-                )  # tangent
-
-                out_dict["infinite_segments"].append(
-                    {"vertex": vor_output.vertices[i], "direction": t}
-                )
-
-    return out_dict
 
+def _extract_all_cell_information(vor_output, ids):
 
-def _extract_all_cell_information(vor_output, data_points):
+    ridge_index = _build_ridge_index(vor_output)
 
     all_cell_info = []
-    for i in range(len(data_points)):
-        info = _extract_cell_information(vor_output, i)
-        all_cell_info.append({**info, **{"closest_point_uuid": data_points.index[i]}})
+    for i in range(len(ids)):
+        info = _extract_cell_information(vor_output, i, ridge_index=ridge_index)
+        all_cell_info.append({**info, **{"closest_point": ids[i]}})
 
     return all_cell_info
 
@@ -93,17 +129,34 @@ def _halfspace_from_vector(direction, point_on_line, point_in_halfspace):
 
 
 class VoronoiCell:
-    def __init__(self, A, b, nearest_neighbours_uuids):
+    def __init__(self, A, b, nearest_neighbours=()):
 
+        # the nearest neighbours are the ids of data points, i.e. their rows
         self.cell_uuid = uuid.uuid4()
-        self.nearest_neighbours_uuids = list(set(nearest_neighbours_uuids))
+        self.nearest_neighbours = np.unique(
+            np.asarray(nearest_neighbours, dtype=np.int32)
+        )
         self.A = A
         self.b = b
 
-    def find_viable_point(self):
-        # find a point that is in the shape and satisfies the linear constraints
-        # we will do this by solving a linear program
-        # we will use the pulp package for this
+    def find_viable_point(self, solver="halfspace_intersection", bounds=None):
+        # find a point that is in the shape and satisfies the linear constraints,
+        # inside the bounds if there is one there
+        if solver == "pulp":
+            return self._find_viable_point_pulp()
+
+        point = halfspace_intersection.find_viable_points(
+            [self.A], [self.b], bounds=bounds
+        )[0]
+
+        if np.isnan(point).any():
+            return None
+
+        return point
+
+    def _find_viable_point_pulp(self):
+        # fallback which solves a linear program with the pulp package, this launches
+        # a CBC process for every call so is much slower than the default
 
         # first create the linear program
         prob = LpProblem("finite_cell_viable_point")
@@ -117,7 +170,9 @@ class VoronoiCell:
             prob += self.A[i, 0] * x + self.A[i, 1] * y >= self.b[i]
 
         # solve the problem
-        prob.solve(pulp.PULP_CBC_CMD(msg=False))
+        instrumentation.count("cbc launches")
+        with instrumentation.stage("cbc viable point"):
+            prob.solve(pulp.PULP_CBC_CMD(msg=False))
 
         # check if the problem is infeasible
         if prob.status == -1:
@@ -126,6 +181,10 @@ class VoronoiCell:
         # return the solution
         return np.array([x.value(), y.value()])
 
+    def polygon(self, bounds):
+        # the vertices of the cell inside the bounds, anticlockwise
+        return cell_polygons([self], bounds)[0]
+
     def plot(self, x_bounds, y_bounds):
         ax = plot.plot_feasible_area(self.A, self.b, x_bounds, y_bounds)
         return ax
@@ -177,7 +236,7 @@ class VoronoiCell:
         finite_line_segments,
         infinite_lines,
         point_in_cell,
-        nearest_neighbours_uuids=[],
+        nearest_neighbours=(),
     ):
 
         finite_half_spaces = [
@@ -195,34 +254,122 @@ class VoronoiCell:
         A = np.array([h[0] for h in finite_half_spaces + infinite_half_spaces])
         b = np.array([h[1] for h in finite_half_spaces + infinite_half_spaces])
 
-        return cls(A=A, b=b, nearest_neighbours_uuids=nearest_neighbours_uuids)
+        return cls(A=A, b=b, nearest_neighbours=nearest_neighbours)
 
 
 # helper functions for dealing with collections of cells
+def find_viable_points(cells, bounds=None):
+    # find a viable point for every cell in one batched pass, None where the cell
+    # has no interior
+    with instrumentation.stage("viable points"):
+        points = halfspace_intersection.find_viable_points(
+            [cell.A for cell in cells], [cell.b for cell in cells], bounds=bounds
+        )
+
+    return [None if np.isnan(point).any() else point for point in points]
+
+
+def _chunks_by_size(sizes, chunk_size):
+    # the indices of systems of halfspaces in chunks of similar size, as a chunk is
+    # padded to its largest system
+    order = np.argsort(sizes, kind="stable")
+
+    return [
+        order[start : start + chunk_size] for start in range(0, len(order), chunk_size)
+    ]
+
+
+def cell_polygons(cells, bounds, chunk_size=256):
+    # the vertices of each cell inside the bounds, anticlockwise, with no vertices
+    # for a cell which does not reach into the bounds
+    polygons = [None] * len(cells)
+    for chunk in _chunks_by_size([len(cell.A) for cell in cells], chunk_size):
+        A, b = halfspace_intersection._pad_systems(
+            [cells[i].A for i in chunk], [cells[i].b for i in chunk]
+        )
+        vertices, n_vertices = halfspace_intersection.intersect_halfspaces(
+            A, b, np.asarray(bounds, dtype=float)
+        )
+        for i, polygon, n in zip(chunk.tolist(), vertices, n_vertices.tolist()):
+            polygons[i] = polygon[:n] if n >= 3 else np.zeros((0, 2))
+
+    return polygons
+
+
+def _reduce_cells(cells, bounds=None, chunk_size=256):
+    # drop the redundant halfspaces of the cells in place, so every cell keeps one
+    # halfspace per edge of its polygon however it was built. Returns None where a
+    # cell has no interior. The cells are reduced chunk_size at a time, as their
+    # systems are padded to the same length
+    reduced_cells = [None] * len(cells)
+    for chunk in _chunks_by_size([len(cell.A) for cell in cells], chunk_size):
+        A_list, b_list = halfspace_intersection.reduce_systems(
+            [cells[i].A for i in chunk], [cells[i].b for i in chunk], bounds=bounds
+        )[:2]
+
+        for i, A, b in zip(chunk.tolist(), A_list, b_list):
+            if A is None:
+                continue
+
+            instrumentation.count("halfspaces pruned", len(cells[i].A) - len(A))
+            cells[i].A = A
+            cells[i].b = b
+            reduced_cells[i] = cells[i]
+
+    return reduced_cells
+
+
+def _combine_cell_with_many(cell, other_cells, bounds=None):
+    # combine one cell with each of a list of others, checking all the combined
+    # cells for feasibility at once and keeping only the halfspaces along the edges
+    # of each combined cell. Returns None where the combination is empty
+    combined_cells = [
+        VoronoiCell(
+            A=np.concatenate([cell.A, other_cell.A]),
+            b=np.concatenate([cell.b, other_cell.b]),
+            nearest_neighbours=np.concatenate(
+                [cell.nearest_neighbours, other_cell.nearest_neighbours]
+            ),
+        )
+        for other_cell in other_cells
+    ]
+
+    instrumentation.count("cells combined", len(combined_cells))
+    with instrumentation.stage("combine cells"):
+        combined_cells = _reduce_cells(combined_cells, bounds=bounds)
+
+    instrumentation.count("cells pruned", sum(cell is None for cell in combined_cells))
+
+    return combined_cells
+
+
 def _combine_cells(cell1, cell2):
-    A_combined = np.concatenate([cell1.A, cell2.A])
-    b_combined = np.concatenate([cell1.b, cell2.b])
-
-    combined_cell = VoronoiCell(
-        A=A_combined,
-        b=b_combined,
-        nearest_neighbours_uuids=cell1.nearest_neighbours_uuids
-        + cell2.nearest_neighbours_uuids,
-    )
+    return _combine_cell_with_many(cell1, [cell2])[0]
+
+
+def _search_bounds(coordinates):
+    # box around the data in which to look for viable points first
+    coordinates = np.asarray(coordinates)
+    lower = coordinates.min(axis=0)
+    upper = coordinates.max(axis=0)
+    margin = np.maximum(upper - lower, 1e-9)
+
+    return np.column_stack([lower - margin, upper + margin])
 
-    if combined_cell.find_viable_point() is None:
-        return None
-    else:
-        return combined_cell
 
+def _data_points_to_cells(coordinates, ids=None, current_neighbours=()):
 
-def _data_points_to_cells(data_points, current_uuid_list=[]):
+    # ids are the ids of the rows of coordinates, by default their positions
+    if ids is None:
+        ids = np.arange(len(coordinates), dtype=np.int32)
 
     # run voronoi algorithm
-    vor = Voronoi(data_points)
+    with instrumentation.stage("scipy voronoi"):
+        vor = Voronoi(coordinates)
+    instrumentation.count("cells created", len(coordinates))
 
     # extract information on cells
-    cell_info = _extract_all_cell_information(vor, data_points)
+    cell_info = _extract_all_cell_information(vor, ids)
 
     # return cell objects
     return [
@@ -230,46 +377,353 @@ def _data_points_to_cells(data_points, current_uuid_list=[]):
             cell["finite_segments"],
             cell["infinite_segments"],
             cell["closest_data_points"][0],
-            nearest_neighbours_uuids=[cell["closest_point_uuid"]] + current_uuid_list,
+            nearest_neighbours=np.append(current_neighbours, cell["closest_point"]),
         )
         for cell in cell_info
     ]
 
 
-def _next_order_voronoi(voronoi_cells, data_points):
+def _cell_from_neighbour_set(nearest_neighbours, coordinates, outsiders=None):
+    # the order k cell of a set of neighbours P is every x which is at least as close
+    # to each p in P as it is to each q outside of P, i.e. 2(p - q).x >= (p - q).(p + q).
+    # outsiders are the ids of the points q to use, by default every point outside P
+    is_inside = np.zeros(len(coordinates), dtype=bool)
+    is_inside[list(nearest_neighbours)] = True
+    inside = coordinates[is_inside]
+    if outsiders is None:
+        outside = coordinates[~is_inside]
+    else:
+        outside = coordinates[outsiders[~is_inside[outsiders]]]
+
+    p = np.repeat(inside, len(outside), axis=0)
+    q = np.tile(outside, (len(inside), 1))
+
+    A, b = order_k_voronoi._bisectors(p, q)
+
+    return VoronoiCell(A=A, b=b, nearest_neighbours=list(nearest_neighbours))
+
+
+def _possible_next_neighbours(cell, polygon, coordinates, tree):
+    # the points outside the cell's neighbour set which can be the next nearest point
+    # somewhere in its polygon. Take the nearest outsider q0 to the centre c of the
+    # polygon: q0 is within max_v |v - q0| of every point of the polygon, so an
+    # outsider further than that plus the radius of the polygon from c is never the
+    # next nearest point. The first few outsiders are always kept so that the
+    # voronoi diagram of what is left can be built
+    is_member = np.zeros(len(coordinates), dtype=bool)
+    is_member[cell.nearest_neighbours] = True
+    if len(polygon) == 0:
+        return np.flatnonzero(~is_member)
+
+    centre = polygon.mean(axis=0)
+    nearest = tree.query(centre, min(len(cell.nearest_neighbours) + 4, len(tree.data)))
+    nearest = np.atleast_1d(nearest[1])
+    nearest = nearest[~is_member[nearest]]
+    if len(nearest) == 0:
+        return nearest
+
+    reach = np.max(np.linalg.norm(polygon - coordinates[nearest[0]], axis=1))
+    radius = np.max(np.linalg.norm(polygon - centre, axis=1)) + reach
+    candidates = np.union1d(tree.query_ball_point(centre, radius), nearest)
+
+    return candidates[~is_member[candidates]].astype(np.int32)
+
+
+def _cells_from_neighbour_sets(neighbour_sets, coordinates, tree, bounds, n_first=8):
+    # the whole cell of each set, with only its non redundant halfspaces. Most of the
+    # points outside a set are too far away to bound its cell, so first cut a larger
+    # polygon S out with the n_first nearest outsiders to the centre c of the set.
+    # For x in S, |x - p| <= D, the furthest any vertex of S is from a member p, and
+    # |x - q| >= |q - c| - r, for r the furthest any vertex is from c. An outsider q
+    # with |q - c| >= r + D therefore never cuts the cell and is left out
+    neighbour_sets = [np.array(sorted(s), dtype=np.int32) for s in neighbour_sets]
+    outer_bounds = halfspace_intersection._outer_bounds(bounds)
+
+    centres = np.array([coordinates[s].mean(axis=0) for s in neighbour_sets])
+    nearest = tree.query(
+        centres, min(len(neighbour_sets[0]) + n_first, len(coordinates))
+    )
+    nearest = nearest[1].reshape(len(centres), -1)
+    larger_cells = [
+        _cell_from_neighbour_set(s, coordinates, outsiders=first)
+        for s, first in zip(neighbour_sets, nearest)
+    ]
+    polygons = cell_polygons(larger_cells, outer_bounds)
+
+    cells = []
+    for s, centre, polygon in zip(neighbour_sets, centres, polygons):
+        outsiders = None
+        if len(polygon) > 0:
+            radius = np.max(np.linalg.norm(polygon - centre, axis=1))
+            furthest = np.max(
+                np.linalg.norm(polygon[:, np.newaxis] - coordinates[s], axis=2)
+            )
+            outsiders = np.array(
+                tree.query_ball_point(centre, radius + furthest), dtype=np.int32
+            )
+        cells.append(_cell_from_neighbour_set(s, coordinates, outsiders=outsiders))
+
+    return [cell for cell in _reduce_cells(cells, bounds=bounds) if cell is not None]
+
+
+def _candidate_pairs(q, min_delaunay=16):
+    # the pairs of candidates whose bisectors bound their voronoi cells. Each cell is
+    # bounded by its delaunay neighbours alone, which for many candidates is far
+    # fewer than every other candidate. Returns the pairs as a padded table with a
+    # row for each candidate and -1 for padding
+    n_candidates = len(q)
+    if n_candidates > min_delaunay:
+        try:
+            triangulation = Delaunay(q)
+        except QhullError:
+            triangulation = None
+
+        # repeated points are left out of the triangulation, so need every pair
+        if triangulation is not None and len(triangulation.coplanar) == 0:
+            indptr, indices = triangulation.vertex_neighbor_vertices
+            degrees = np.diff(indptr)
+            pairs = np.full((n_candidates, degrees.max()), -1)
+            rows = np.repeat(np.arange(n_candidates), degrees)
+            pairs[rows, np.arange(len(indices)) - indptr[rows]] = indices
+            return pairs
+
+    others = ~np.eye(n_candidates, dtype=bool)
+
+    return np.broadcast_to(np.arange(n_candidates), (n_candidates, n_candidates))[
+        others
+    ].reshape(n_candidates, n_candidates - 1)
+
+
+def _fragment_halfspaces(cell, candidates, coordinates):
+    # the fragment of the cell in which candidate q is the next nearest point is the
+    # cell intersected with every x at least as close to q as to the other
+    # candidates. Returns the halfspaces of every fragment as arrays with a row each
+    q = coordinates[candidates]
+    n_candidates = len(candidates)
+    pairs = _candidate_pairs(q)
+
+    A, b = order_k_voronoi._bisectors(q[:, np.newaxis], q[np.maximum(pairs, 0)])
+    A[pairs < 0] = 0
+    b[pairs < 0] = -1
+
+    A = np.concatenate(
+        [np.broadcast_to(cell.A, (n_candidates,) + cell.A.shape), A], axis=1
+    )
+    b = np.concatenate([np.broadcast_to(cell.b, (n_candidates,) + cell.b.shape), b], 1)
+
+    return A, b
+
+
+def _next_order_voronoi(voronoi_cells, coordinates, chunk_size=4096):
 
     print("Finding next order voronoi cells")
-    out_cells = []
-    for cell in voronoi_cells:
-        relevant_data_points = data_points.drop(cell.nearest_neighbours_uuids).copy()
-        new_cells = _data_points_to_cells(
-            relevant_data_points, current_uuid_list=cell.nearest_neighbours_uuids
+
+    # the same set of neighbours is reached through every ordering of its members, so
+    # keep a registry keyed by the neighbour set. The fragments of the cells are
+    # checked for feasibility chunk_size at a time, and a fragment whose set is
+    # already in the registry is pruned before we solve for it. Every set found is
+    # then replaced by the whole cell for that set
+    cell_registry = {}
+    bounds = _search_bounds(coordinates)
+    tree = KDTree(coordinates)
+    polygons = cell_polygons(
+        voronoi_cells, halfspace_intersection._outer_bounds(bounds)
+    )
+
+    pending_A = []
+    pending_b = []
+    pending_sets = []
+
+    def check_pending():
+        instrumentation.count("cells combined", len(pending_sets))
+        for chunk in _chunks_by_size([len(A) for A in pending_A], 1024):
+            points = halfspace_intersection.find_viable_points(
+                [pending_A[i] for i in chunk], [pending_b[i] for i in chunk], bounds
+            )
+            feasible = ~np.isnan(points).any(axis=1)
+            instrumentation.count("cells pruned", np.count_nonzero(~feasible))
+            for i in chunk[feasible].tolist():
+                cell_registry[pending_sets[i]] = True
+
+        pending_A.clear()
+        pending_b.clear()
+        pending_sets.clear()
+
+    for i, cell in enumerate(voronoi_cells):
+        instrumentation.progress("next order voronoi", i, len(voronoi_cells))
+
+        # only the points which can be nearest in the cell need a fragment
+        candidates = _possible_next_neighbours(cell, polygons[i], coordinates, tree)
+        instrumentation.peak("possible next neighbours", len(candidates))
+        members = cell.nearest_neighbours.tolist()
+        neighbour_sets = [
+            frozenset(members + [candidate]) for candidate in candidates.tolist()
+        ]
+        new = [
+            j
+            for j, neighbour_set in enumerate(neighbour_sets)
+            if neighbour_set not in cell_registry
+        ]
+        instrumentation.count("fragments pruned", len(candidates) - len(new))
+        if len(new) == 0:
+            continue
+
+        A, b = _fragment_halfspaces(cell, candidates, coordinates)
+        pending_A.extend(A[new])
+        pending_b.extend(b[new])
+        pending_sets.extend(neighbour_sets[j] for j in new)
+
+        if len(pending_sets) >= chunk_size:
+            check_pending()
+
+    if len(pending_sets) > 0:
+        check_pending()
+
+    instrumentation.peak("cells", len(cell_registry))
+
+    # replace every set found by its whole cell, with only the few halfspaces along
+    # its edges
+    with instrumentation.stage("reduce cells"):
+        return _cells_from_neighbour_sets(
+            list(cell_registry), coordinates, tree, bounds
         )
 
-        for new_cell in new_cells:
-            new_cell = _combine_cells(cell, new_cell)
-            if new_cell is not None:
-                out_cells.append(new_cell)
 
-    return out_cells
+def _order_k_cells(coordinates, n, bounds=None):
 
+    # build the order n cells directly with the order_k_voronoi engine
+    with instrumentation.stage("order k diagram"):
+        diagram = order_k_voronoi.order_k_voronoi(coordinates, n, bounds=bounds)
 
-def nth_order_voronoi(data_points, n=1):
+    A, b = order_k_voronoi.cell_halfspaces(
+        coordinates,
+        diagram["vertices"],
+        diagram["n_vertices"],
+        diagram["edge_points"],
+    )
+    instrumentation.peak("cells", len(A))
 
-    # create the first order voronoi cells
-    voronoi_cells = _data_points_to_cells(data_points)
+    return [
+        VoronoiCell(
+            A=A[i, :n_vertices],
+            b=b[i, :n_vertices],
+            nearest_neighbours=neighbour_set,
+        )
+        for i, (neighbour_set, n_vertices) in enumerate(
+            zip(diagram["neighbour_sets"], diagram["n_vertices"])
+        )
+    ]
+
+
+def nth_order_voronoi(data_points, n=1, method="order_k"):
+
+    # the order_k method walks the order n diagram directly, while the incremental
+    # method builds every order up to n from the one before it
+    coordinates = point_set.PointSet.from_data_points(data_points).coordinates
+    if method == "order_k":
+        with instrumentation.stage("voronoi cells"):
+            return _order_k_cells(coordinates, n)
 
-    for i in range(n - 1):
-        voronoi_cells = _next_order_voronoi(voronoi_cells, data_points)
+    with instrumentation.stage("voronoi cells"):
+        # create the first order voronoi cells
+        voronoi_cells = _data_points_to_cells(coordinates)
+
+        for i in range(n - 1):
+            voronoi_cells = _next_order_voronoi(voronoi_cells, coordinates)
 
     return voronoi_cells
 
 
 class VoronoiCells:
-    def __init__(self, data_points, nth_order=1):
+    def __init__(self, data_points, nth_order=1, method="order_k", cache=None):
 
+        # the cells refer to the data points by id, the external ids of the points
+        # are kept in points. cache is a voronoi_cache.VoronoiCache or the directory
+        # of one, from which the cells and their viable points are loaded if these
+        # points have been seen before, and to which they are saved if not
         self.data_points = data_points
-        self.voronoi_cells = nth_order_voronoi(data_points, n=nth_order)
+        self.points = point_set.PointSet.from_data_points(data_points)
+        self._voronoi_cells = None
+        self._viable_points = None
+        self._cached = None
+
+        if cache is None:
+            self._voronoi_cells = nth_order_voronoi(
+                self.points, n=nth_order, method=method
+            )
+            return
+
+        if not isinstance(cache, voronoi_cache.VoronoiCache):
+            cache = voronoi_cache.VoronoiCache(cache)
+        key = cache.key(self.points.coordinates, nth_order, method=method)
+
+        self._cached = cache.load(key)
+        instrumentation.count(
+            "voronoi cache misses" if self._cached is None else "voronoi cache hits"
+        )
+        if self._cached is None:
+            self._voronoi_cells = nth_order_voronoi(
+                self.points, n=nth_order, method=method
+            )
+            cache.save(key, self._voronoi_cells, self.find_viable_points())
+
+    @property
+    def voronoi_cells(self):
+        # cells loaded from the cache are only created when they are first needed
+        if self._voronoi_cells is None:
+            self._voronoi_cells = [
+                VoronoiCell(
+                    A=np.array(A[:n_constraints]),
+                    b=np.array(b[:n_constraints]),
+                    nearest_neighbours=neighbour_set,
+                )
+                for A, b, n_constraints, neighbour_set in zip(
+                    self._cached["A"],
+                    self._cached["b"],
+                    self._cached["n_constraints"].tolist(),
+                    self._cached["neighbour_sets"],
+                )
+            ]
+
+        return self._voronoi_cells
+
+    def find_viable_points(self):
+        # a viable point for every cell, preferring points near the data
+        if self._viable_points is None and self._cached is not None:
+            points = np.array(self._cached["viable_points"])
+            has_point = ~np.isnan(points).any(axis=1)
+            self._viable_points = [
+                point if viable else None
+                for point, viable in zip(points, has_point.tolist())
+            ]
+
+        if self._viable_points is None:
+            self._viable_points = find_viable_points(
+                self.voronoi_cells, bounds=_search_bounds(self.points.coordinates)
+            )
+
+        return self._viable_points
+
+    def __len__(self):
+        if self._voronoi_cells is None:
+            return len(self._cached["n_constraints"])
+
+        return len(self._voronoi_cells)
+
+    def nearest_neighbours(self, region_index, external=False):
+        # the ids of a cell's nearest neighbours, or their external ids
+        ids = self.voronoi_cells[region_index].nearest_neighbours
+        if external:
+            return self.points.to_external(ids)
+
+        return ids
+
+    def polygons(self, bounds=None):
+        # the vertices of every cell, by default inside a box around the data
+        if bounds is None:
+            bounds = _search_bounds(self.points.coordinates)
+
+        return cell_polygons(self.voronoi_cells, bounds)
 
     def plot(self, region_index, x_bounds, y_bounds):
 
@@ -277,20 +731,20 @@ class VoronoiCells:
 
         # add all the data points
         ax.scatter(
-            self.data_points["x"],
-            self.data_points["y"],
+            self.points.coordinates[:, 0],
+            self.points.coordinates[:, 1],
             c="k",
             s=5,
             label="All data Points",
         )
 
         # add the data points that define the cell
-        defining_points = self.data_points.loc[
-            self.voronoi_cells[region_index].nearest_neighbours_uuids
+        defining_points = self.points.coordinates[
+            self.voronoi_cells[region_index].nearest_neighbours
         ]
         ax.scatter(
-            defining_points["x"],
-            defining_points["y"],
+            defining_points[:, 0],
+            defining_points[:, 1],
             c="r",
             s=20,
             label="Nearest neighbours",
@@ -0,0 +1,436 @@
+import os
+import sys
+import warnings
+import numpy as np
+from scipy.spatial import KDTree
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(root_dir)
+from query_point_algorithms import halfspace_intersection, instrumentation
+
+# Dedicated construction of the order k Voronoi diagram, i.e. every distinct set of k
+# nearest neighbours along with the region of the plane which returns it.
+#
+# Rather than building every order up to k, the order k diagram is walked directly.
+# Two order k cells which share an edge differ by swapping one point: the edge lies on
+# the bisector of a point p in the cell's set and a point q outside it, and crossing
+# the edge swaps p for q. Starting from the cells containing the data points we
+# compute cells a batch at a time and step across each of their edges to find new
+# cells, until every cell inside the bounds has been visited. This visits each of the
+# O(k(n - k)) cells once, rather than the O(k^2 n) cells of all the lower orders.
+#
+# A cell for the set P is {x : |x - p| <= |x - q| for all p in P and q outside P}, but
+# only a handful of these k(n - k) constraints matter. For each cell we use the
+# members of P furthest from a point known to be in the cell and the outside points
+# closest to it, then check every vertex of the resulting polygon really has P as its
+# k nearest neighbours. Since the cell is convex this proves the polygon is exact. A
+# vertex which fails is cut off with the constraint between its furthest member and
+# its nearest outside point, and the check repeated.
+#
+# Only cells which intersect the bounds are found, by default a box around the data
+# with a margin of 1000 times its width on each side, which in practice finds every
+# cell. The cells are returned clipped to the bounds, so every point of a cell's
+# polygon returns the cell's set.
+#
+# The diagram is computed on the coordinates moved to their centroid and scaled to a
+# width of one, and the vertices moved back at the end. Otherwise for data far from
+# the origin, e.g. latitudes and longitudes, |p|^2 - |q|^2 is a difference of two
+# large numbers and the cells are lost in its rounding error. For the same reason
+# the constraints are written as 2(p - q).x >= (p - q).(p + q).
+
+
+def _default_bounds(coordinates):
+    lower = coordinates.min(axis=0)
+    upper = coordinates.max(axis=0)
+    margin = 1000 * np.maximum(upper - lower, 1e-9)
+
+    return np.column_stack([lower - margin, upper + margin])
+
+
+def _in_rows(values, sorted_rows):
+    # for each row check which of values[i] are in sorted_rows[i], by offsetting each
+    # row so that all rows together make one sorted array
+    n_rows = len(sorted_rows)
+    width = max(np.max(values), np.max(sorted_rows)) + 1
+    offset = width * np.arange(n_rows, dtype=np.int64)[:, np.newaxis]
+
+    flat = (sorted_rows + offset).ravel()
+    shifted = values + offset
+
+    position = np.minimum(np.searchsorted(flat, shifted), len(flat) - 1)
+
+    return flat[position] == shifted
+
+
+def _candidate_constraints(coordinates, tree, neighbour_sets, seeds, n_inside, n_out):
+    # choose the members of each set furthest from its seed and the outside points
+    # closest to it, and form the constraint that x is closer to each member than
+    # to each outside point: 2(p - q).x >= |p|^2 - |q|^2
+    k = neighbour_sets.shape[1]
+
+    member_distances = np.sum(
+        (coordinates[neighbour_sets] - seeds[:, np.newaxis]) ** 2, axis=2
+    )
+    furthest = np.argpartition(-member_distances, n_inside - 1, axis=1)[:, :n_inside]
+    inside = np.take_along_axis(neighbour_sets, furthest, axis=1)
+
+    instrumentation.count("tree queries", len(seeds))
+    nearest = tree.query(seeds, k + n_out)[1].reshape(len(seeds), -1)
+    is_member = _in_rows(nearest, neighbour_sets)
+    first_outside = np.argsort(is_member, axis=1, kind="stable")[:, :n_out]
+    outside = np.take_along_axis(nearest, first_outside, axis=1)
+
+    p = np.repeat(inside, n_out, axis=1)
+    q = np.tile(outside, (1, n_inside))
+
+    A, b = _bisectors(coordinates[p], coordinates[q])
+
+    return A, b, p, q
+
+
+def _bisectors(p, q):
+    # the halfspaces of the points x at least as close to p as to q
+    return 2 * (p - q), np.sum((p - q) * (p + q), axis=-1)
+
+
+def _verify_cells(coordinates, tree, neighbour_sets, vertices, n_vertices, tolerance):
+    # a cell is exact if each of its vertices is at least as close to every member of
+    # the set as it is to any point outside of it. Returns which vertices fail
+    n_cells, max_vertices = vertices.shape[:2]
+
+    in_use = np.arange(max_vertices)[np.newaxis] < n_vertices[:, np.newaxis]
+    cell_of_vertex = np.nonzero(in_use)[0]
+    points = vertices[in_use]
+
+    member_distances = np.sum(
+        (coordinates[neighbour_sets[cell_of_vertex]] - points[:, np.newaxis]) ** 2,
+        axis=2,
+    )
+
+    # if some point outside the set is closer than the furthest member, then more
+    # points than members are within that distance of the vertex. Far from the data
+    # the rounding error in the distances grows with them, so the tolerance does too
+    furthest = np.max(member_distances, axis=1)
+    threshold = furthest - tolerance - 1e-12 * furthest
+    instrumentation.count("tree ball queries", len(points))
+    closer_points = tree.query_ball_point(
+        points, np.sqrt(np.maximum(threshold, 0)), return_length=True
+    )
+    closer_members = np.sum(member_distances <= threshold[:, np.newaxis], axis=1)
+
+    failed = np.zeros((n_cells, max_vertices), dtype=bool)
+    failed[in_use] = closer_points > closer_members
+
+    return failed
+
+
+def _clip_cells(vertices, n_vertices, labels, A, b, first_label):
+    # clip the polygons by each column of constraints, labelling the new edges with
+    # the index of the column they came from
+    for j in range(A.shape[1]):
+        vertices, n_vertices, labels = halfspace_intersection.clip_labelled_polygons(
+            vertices,
+            n_vertices,
+            labels,
+            A[:, j],
+            b[:, j],
+            np.full(len(A), first_label + j),
+        )
+
+    return vertices, n_vertices, labels
+
+
+def _compute_cells(coordinates, tree, neighbour_sets, seeds, bounds, tolerance):
+    # compute the polygon of each cell inside the bounds, along with the pair of
+    # points each edge is the bisector of (-1 for edges on the bounds)
+    n_cells, k = neighbour_sets.shape
+
+    vertices = np.zeros((n_cells, 1, 2))
+    n_vertices = np.zeros(n_cells, dtype=int)
+    edge_points = np.zeros((n_cells, 1, 2), dtype=np.int32)
+
+    A, b, p, q = _candidate_constraints(
+        coordinates,
+        tree,
+        neighbour_sets,
+        seeds,
+        min(k, 6),
+        min(len(coordinates) - k, 6),
+    )
+    cell_vertices, cell_n_vertices = halfspace_intersection._box_polygons(
+        bounds, n_cells
+    )
+    labels = np.full((n_cells, 4), -1)
+    cell_vertices, cell_n_vertices, labels = _clip_cells(
+        cell_vertices, cell_n_vertices, labels, A, b, 0
+    )
+    to_compute = np.arange(n_cells)
+    n_candidates = 2
+    exhausted = False
+
+    while len(to_compute) > 0:
+        failed_vertices = _verify_cells(
+            coordinates,
+            tree,
+            neighbour_sets[to_compute],
+            cell_vertices,
+            cell_n_vertices,
+            tolerance,
+        )
+        verified = ~np.any(failed_vertices, axis=1)
+
+        # once the cells have been cut with every member and every outside point
+        # near their failing vertices, what is left failing is rounding error
+        if exhausted and not np.all(verified):
+            warnings.warn(
+                f"{np.count_nonzero(~verified)} order {k} cells could not be verified "
+                "after cutting with every point, keeping them as they are",
+                RuntimeWarning,
+            )
+            verified[:] = True
+
+        # store the verified cells, growing the padded arrays if needed
+        if cell_vertices.shape[1] > vertices.shape[1]:
+            extra = cell_vertices.shape[1] - vertices.shape[1]
+            vertices = np.pad(vertices, ((0, 0), (0, extra), (0, 0)))
+            edge_points = np.pad(edge_points, ((0, 0), (0, extra), (0, 0)))
+
+        done = to_compute[verified]
+        width = cell_vertices.shape[1]
+        safe_labels = np.maximum(labels[verified], 0)
+        rows = np.arange(len(done))[:, np.newaxis]
+
+        vertices[done, :width] = cell_vertices[verified]
+        n_vertices[done] = cell_n_vertices[verified]
+        edge_points[done, :width, 0] = np.where(
+            labels[verified] >= 0, p[verified][rows, safe_labels], -1
+        )
+        edge_points[done, :width, 1] = np.where(
+            labels[verified] >= 0, q[verified][rows, safe_labels], -1
+        )
+
+        to_compute = to_compute[~verified]
+        if len(to_compute) == 0:
+            break
+
+        instrumentation.count("cells cut again", len(to_compute))
+
+        # the true cell lies inside each failed polygon, so cut the failed polygons
+        # down further. At a vertex outside the cell its nearest point outside the
+        # set is closer than its furthest member, so the constraint between those
+        # two points removes it
+        cell_vertices = cell_vertices[~verified]
+        cell_n_vertices = cell_n_vertices[~verified]
+        labels = labels[~verified]
+        failed_vertices = failed_vertices[~verified]
+        n_failed = len(to_compute)
+
+        # line up the failing vertices of each polygon, repeating the first one to
+        # pad the rows to the same length
+        n_failing = failed_vertices.sum(axis=1)
+        max_failing = n_failing.max()
+        order = np.argsort(~failed_vertices, axis=1, kind="stable")[:, :max_failing]
+        order = np.where(
+            np.arange(max_failing)[np.newaxis] < n_failing[:, np.newaxis],
+            order,
+            order[:, :1],
+        )
+        vertex_seeds = cell_vertices[np.arange(n_failed)[:, np.newaxis], order]
+
+        extra_A, extra_b, extra_p, extra_q = _candidate_constraints(
+            coordinates,
+            tree,
+            np.repeat(neighbour_sets[to_compute], max_failing, axis=0),
+            vertex_seeds.reshape(-1, 2),
+            min(k, n_candidates),
+            min(len(coordinates) - k, n_candidates),
+        )
+
+        cell_vertices, cell_n_vertices, labels = _clip_cells(
+            cell_vertices,
+            cell_n_vertices,
+            labels,
+            extra_A.reshape(n_failed, -1, 2),
+            extra_b.reshape(n_failed, -1),
+            p.shape[1],
+        )
+        p = np.concatenate([p[~verified], extra_p.reshape(n_failed, -1)], axis=1)
+        q = np.concatenate([q[~verified], extra_q.reshape(n_failed, -1)], axis=1)
+
+        # cells which take many cuts, typically long thin cells far from the data,
+        # get more candidates each time round, up to every point
+        exhausted = n_candidates >= max(k, len(coordinates) - k)
+        n_candidates *= 2
+
+    return vertices, n_vertices, edge_points
+
+
+def _neighbouring_cells(coordinates, neighbour_sets, vertices, n_vertices, edge_points):
+    # step across every edge that is not on the bounds, swapping the point p on this
+    # side of the edge for the point q on the other
+    max_vertices = vertices.shape[1]
+    index = np.arange(max_vertices)
+    following = np.where(
+        index[np.newaxis] + 1 < n_vertices[:, np.newaxis], index[np.newaxis] + 1, 0
+    )
+    next_vertices = np.take_along_axis(vertices, following[:, :, np.newaxis], axis=1)
+
+    lengths = np.sum((next_vertices - vertices) ** 2, axis=2)
+    scale = np.max(np.ptp(coordinates, axis=0)) ** 2
+    use = (
+        (index[np.newaxis] < n_vertices[:, np.newaxis])
+        & (edge_points[:, :, 0] >= 0)
+        & (lengths > 1e-18 * scale)
+    )
+
+    cell_of_edge, edge = np.nonzero(use)
+    p = edge_points[cell_of_edge, edge, 0]
+    q = edge_points[cell_of_edge, edge, 1]
+
+    new_sets = neighbour_sets[cell_of_edge].copy()
+    new_sets[new_sets == p[:, np.newaxis]] = q
+
+    # seed each new cell with the middle of the edge, which is on its boundary
+    seeds = (vertices[cell_of_edge, edge] + next_vertices[cell_of_edge, edge]) / 2
+
+    return new_sets, seeds
+
+
+def _set_hashes(neighbour_sets, point_hashes):
+    # hash each set as the sum of a random 64 bit number per member, which does not
+    # depend on the order of the members and wraps around on overflow
+    return np.sum(point_hashes[neighbour_sets], axis=1, dtype=np.uint64)
+
+
+def order_k_voronoi(coordinates, k, bounds=None, batch_size=20000):
+    # returns the sorted indices of the k nearest neighbours for every cell, and each
+    # cell's polygon inside the bounds as padded vertices, the number of vertices in
+    # use and the pair of points (p, q) whose bisector each edge lies on
+    coordinates = np.asarray(coordinates, dtype=float)
+    k = min(k, len(coordinates))
+
+    if bounds is None:
+        bounds = _default_bounds(coordinates)
+    bounds = np.asarray(bounds, dtype=float)
+
+    # with k at least the number of points there is a single cell
+    if k == len(coordinates):
+        vertices, n_vertices = halfspace_intersection._box_polygons(bounds, 1)
+        return {
+            "neighbour_sets": np.arange(k, dtype=np.int32)[np.newaxis],
+            "vertices": vertices,
+            "n_vertices": n_vertices,
+            "edge_points": np.full((1, 4, 2), -1, dtype=np.int32),
+        }
+
+    # work relative to the centroid with the data scaled to a width of one
+    centre = coordinates.mean(axis=0)
+    scale = np.max(np.ptp(coordinates, axis=0))
+    if scale == 0:
+        scale = 1.0
+    coordinates = (coordinates - centre) / scale
+    bounds = (bounds - centre[:, np.newaxis]) / scale
+
+    instrumentation.count("kdtree builds")
+    tree = KDTree(coordinates)
+    tolerance = 1e-9
+
+    # start from the cells containing the data points themselves, which gives a
+    # large first batch and so far fewer rounds than walking out from a single cell
+    point_hashes = np.random.default_rng(0).integers(
+        0, 2**64 - 1, len(coordinates), dtype=np.uint64, endpoint=True
+    )
+
+    first_sets = (
+        tree.query(coordinates, k)[1].reshape(len(coordinates), -1).astype(np.int32)
+    )
+    first_hashes, first = np.unique(
+        _set_hashes(first_sets, point_hashes), return_index=True
+    )
+
+    visited = set(first_hashes.tolist())
+    frontier_sets = [np.sort(first_sets[first], axis=1)]
+    frontier_seeds = [coordinates[first]]
+    cells = []
+
+    while len(frontier_sets) > 0:
+        pending_sets = np.concatenate(frontier_sets)
+        pending_seeds = np.concatenate(frontier_seeds)
+        frontier_sets, frontier_seeds = [], []
+        instrumentation.peak("order k frontier", len(pending_sets))
+
+        for start in range(0, len(pending_sets), batch_size):
+            neighbour_sets = pending_sets[start : start + batch_size]
+            seeds = pending_seeds[start : start + batch_size]
+
+            with instrumentation.stage("order k cell polygons"):
+                vertices, n_vertices, edge_points = _compute_cells(
+                    coordinates, tree, neighbour_sets, seeds, bounds, tolerance
+                )
+            instrumentation.count("cells created", len(neighbour_sets))
+            cells.append((neighbour_sets, vertices, n_vertices, edge_points))
+
+            new_sets, new_seeds = _neighbouring_cells(
+                coordinates, neighbour_sets, vertices, n_vertices, edge_points
+            )
+            new_hashes, first = np.unique(
+                _set_hashes(new_sets, point_hashes), return_index=True
+            )
+
+            unvisited = []
+            for i, new_hash in zip(first.tolist(), new_hashes.tolist()):
+                if new_hash not in visited:
+                    visited.add(new_hash)
+                    unvisited.append(i)
+
+            frontier_sets.append(np.sort(new_sets[unvisited], axis=1))
+            frontier_seeds.append(new_seeds[unvisited])
+
+        if sum(len(sets) for sets in frontier_sets) == 0:
+            break
+
+    max_vertices = max(cell[1].shape[1] for cell in cells)
+
+    def _pad(array):
+        return np.pad(
+            array,
+            [(0, 0), (0, max_vertices - array.shape[1])] + [(0, 0)] * (array.ndim - 2),
+        )
+
+    return {
+        "neighbour_sets": np.concatenate([cell[0] for cell in cells]),
+        "vertices": np.concatenate([_pad(cell[1]) for cell in cells]) * scale + centre,
+        "n_vertices": np.concatenate([cell[2] for cell in cells]),
+        "edge_points": np.concatenate([_pad(cell[3]) for cell in cells]),
+    }
+
+
+def cell_halfspaces(coordinates, vertices, n_vertices, edge_points):
+    # the halfspaces Ax >= b of each cell, one per edge of its polygon and padded in
+    # the same way as the vertices. Edges on the bounds are included so that every
+    # point in the halfspaces returns the cell's set
+    coordinates = np.asarray(coordinates, dtype=float)
+    index = np.arange(vertices.shape[1])
+    following = np.where(
+        index[np.newaxis] + 1 < n_vertices[:, np.newaxis], index[np.newaxis] + 1, 0
+    )
+    next_vertices = np.take_along_axis(vertices, following[:, :, np.newaxis], axis=1)
+
+    p = coordinates[np.maximum(edge_points[:, :, 0], 0)]
+    q = coordinates[np.maximum(edge_points[:, :, 1], 0)]
+    on_bounds = edge_points[:, :, 0] < 0
+
+    # the inward normal of an anticlockwise edge on the bounds
+    normals = np.stack(
+        [
+            vertices[:, :, 1] - next_vertices[:, :, 1],
+            next_vertices[:, :, 0] - vertices[:, :, 0],
+        ],
+        axis=2,
+    )
+
+    bisector_A, bisector_b = _bisectors(p, q)
+    A = np.where(on_bounds[:, :, np.newaxis], normals, bisector_A)
+    b = np.where(on_bounds, np.sum(normals * vertices, axis=2), bisector_b)
+
+    return A, b
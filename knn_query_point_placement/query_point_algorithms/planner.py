@@ -0,0 +1,263 @@
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(root_dir)
+from query_point_algorithms import (
+    greedy_set_cover,
+    grid_search,
+    ilp_set_cover,
+    instrumentation,
+    local_search,
+    nth_degree_voronoi,
+    point_set,
+    tiling,
+    trim_extremities,
+    uniform_random,
+)
+
+
+# one interface to every placement algorithm. A Problem holds the data points and k
+# along with what the algorithms share: the PointSet with its KDTree and the k nearest
+# neighbours of every point, and the order k voronoi cells, each built the first time
+# an algorithm needs it. The algorithms are registered by name in ALGORITHMS, as
+# functions taking a Problem and keyword arguments and returning query points, so
+# solving one problem with several algorithms builds the tree, the neighbours and the
+# cells once. Every solve returns a Plan, holding the query points, the points each one
+# returns and statistics on the coverage, so plans are compared the same way whichever
+# algorithm made them.
+
+ALGORITHMS = {}
+
+
+def register(name):
+    # a decorator adding a function taking a Problem to ALGORITHMS under name
+    def decorator(function):
+        ALGORITHMS[name] = function
+        return function
+
+    return decorator
+
+
+class Plan:
+    def __init__(self, problem, query_points, algorithm=None, seconds=None):
+
+        self.problem = problem
+        self.algorithm = algorithm
+        self.seconds = seconds
+        self.query_points = np.asarray(query_points, dtype=float).reshape(-1, 2)
+
+        # the ids of the points each query point returns, as a row per query point
+        instrumentation.count("tree queries", len(self.query_points))
+        neighbours = problem.tree.query(self.query_points, problem.k_nearest_neighbours)
+        self.neighbours = neighbours[1].reshape(len(self.query_points), -1)
+        self.counts = np.bincount(self.neighbours.ravel(), minlength=len(problem))
+
+    def __len__(self):
+        return len(self.query_points)
+
+    @property
+    def covered(self):
+        return self.counts > 0
+
+    @property
+    def uncovered(self):
+        return np.flatnonzero(self.counts == 0)
+
+    @property
+    def covers_all(self):
+        return bool(np.all(self.counts > 0))
+
+    @property
+    def coverage(self):
+        # the fraction of the points returned by at least one query point
+        return float(np.count_nonzero(self.counts) / max(len(self.problem), 1))
+
+    @property
+    def redundancy(self):
+        # how many query points return each covered point on average
+        return float(self.counts.sum() / max(np.count_nonzero(self.counts), 1))
+
+    @property
+    def ratio(self):
+        # the number of query points over the lower bound of n / k
+        return len(self) / self.problem.lower_bound
+
+    def returned(self, external=False):
+        # the ids of the points each query point returns, or their external ids
+        if external:
+            return self.problem.points.to_external(self.neighbours)
+
+        return self.neighbours
+
+    def improve(self, time_limit=10.0, seed=None):
+        # a smaller plan found by local_search, returning every point this one does
+        start = time.perf_counter()
+        query_points = local_search.improve(
+            self.problem.points,
+            self.problem.k_nearest_neighbours,
+            self.query_points,
+            time_limit=time_limit,
+            seed=seed,
+        )[0]
+
+        return Plan(
+            self.problem,
+            query_points,
+            algorithm=f"{self.algorithm}+local_search",
+            seconds=(self.seconds or 0.0) + time.perf_counter() - start,
+        )
+
+    def summary(self):
+        return {
+            "algorithm": self.algorithm,
+            "query_points": len(self),
+            "lower_bound": self.problem.lower_bound,
+            "ratio": self.ratio,
+            "coverage": self.coverage,
+            "uncovered": len(self.uncovered),
+            "redundancy": self.redundancy,
+            "seconds": self.seconds,
+        }
+
+
+class Problem:
+    def __init__(self, data_points, k_nearest_neighbours, cache=None):
+
+        # cache is a voronoi_cache.VoronoiCache or its directory, used for the cells
+        self.points = point_set.PointSet.from_data_points(data_points)
+        self.k_nearest_neighbours = min(k_nearest_neighbours, len(self.points))
+        self.cache = cache
+        self._voronoi_cells = None
+
+    def __len__(self):
+        return len(self.points)
+
+    @property
+    def tree(self):
+        return self.points.tree
+
+    @property
+    def nearest(self):
+        # the distances to and ids of the k nearest points to every point
+        return self.points.nearest(self.k_nearest_neighbours)
+
+    @property
+    def bounds(self):
+        # the x and y bounds of the points
+        lower = self.points.coordinates.min(axis=0)
+        upper = self.points.coordinates.max(axis=0)
+
+        return [lower[0], upper[0]], [lower[1], upper[1]]
+
+    @property
+    def lower_bound(self):
+        # every query point returns at most k points
+        return max(-(-len(self) // self.k_nearest_neighbours), 1)
+
+    @property
+    def voronoi_cells(self):
+        if self._voronoi_cells is None:
+            self._voronoi_cells = nth_degree_voronoi.VoronoiCells(
+                self.points, nth_order=self.k_nearest_neighbours, cache=self.cache
+            )
+
+        return self._voronoi_cells
+
+    def plan(self, query_points, algorithm=None, seconds=None):
+        # a Plan of any query points, e.g. ones made outside the registry
+        return Plan(self, query_points, algorithm=algorithm, seconds=seconds)
+
+    def solve(self, algorithm, **kwargs):
+        # run algorithm, a name in ALGORITHMS or a function taking a Problem, with
+        # kwargs passed on to it
+        if callable(algorithm):
+            name, function = getattr(algorithm, "__name__", None), algorithm
+        elif algorithm in ALGORITHMS:
+            name, function = algorithm, ALGORITHMS[algorithm]
+        else:
+            raise ValueError(
+                f"Unknown algorithm {algorithm}, expected one of {sorted(ALGORITHMS)}"
+            )
+
+        start = time.perf_counter()
+        with instrumentation.stage(f"solve {name}"):
+            query_points = function(self, **kwargs)
+
+        return Plan(
+            self, query_points, algorithm=name, seconds=time.perf_counter() - start
+        )
+
+    def solve_all(self, algorithms=None):
+        # a Plan from each algorithm, by default every registered one. algorithms is
+        # a list of names, or a dictionary from names to the kwargs of each
+        if algorithms is None:
+            algorithms = list(ALGORITHMS)
+        if not isinstance(algorithms, dict):
+            algorithms = {name: {} for name in algorithms}
+
+        return {name: self.solve(name, **kwargs) for name, kwargs in algorithms.items()}
+
+    def compare(self, algorithms=None):
+        # the summaries of the plans from solve_all as a DataFrame, one row each
+        plans = self.solve_all(algorithms)
+
+        return pd.DataFrame([plan.summary() for plan in plans.values()])
+
+
+@register("uniform_random")
+def _uniform_random(problem, **kwargs):
+    return uniform_random.get_query_points(
+        problem.points, problem.k_nearest_neighbours, **kwargs
+    )
+
+
+@register("trim_extremities")
+def _trim_extremities(problem, **kwargs):
+    return trim_extremities.get_query_points(
+        problem.points, problem.k_nearest_neighbours, **kwargs
+    )
+
+
+@register("greedy_set_cover")
+def _greedy_set_cover(problem, **kwargs):
+    return greedy_set_cover.get_query_points(
+        problem.points,
+        problem.k_nearest_neighbours,
+        voronoi_cells=problem.voronoi_cells,
+        **kwargs,
+    )
+
+
+@register("ilp_set_cover")
+def _ilp_set_cover(problem, **kwargs):
+    return ilp_set_cover.get_query_points(
+        problem.points,
+        problem.k_nearest_neighbours,
+        voronoi_cells=problem.voronoi_cells,
+        **kwargs,
+    )
+
+
+@register("grid_search")
+def _grid_search(problem, size_of_grid_search=200, **kwargs):
+    x_bounds, y_bounds = problem.bounds
+
+    return grid_search.get_query_points(
+        problem.points,
+        problem.k_nearest_neighbours,
+        x_bounds,
+        y_bounds,
+        size_of_grid_search,
+        **kwargs,
+    )
+
+
+@register("tiling")
+def _tiling(problem, **kwargs):
+    return tiling.get_query_points(
+        problem.points, problem.k_nearest_neighbours, **kwargs
+    )
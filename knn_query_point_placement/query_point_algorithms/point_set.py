@@ -0,0 +1,108 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+from scipy.spatial import KDTree
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(root_dir)
+from query_point_algorithms import instrumentation
+
+
+# the algorithms refer to data points by their row, an int32 id from 0 to n - 1, with
+# the coordinates held in one contiguous float64 array. Any other ids the points came
+# with, e.g. the index of a DataFrame, are only kept to translate to and from at the
+# edges of the package.
+
+
+class PointSet:
+    def __init__(self, coordinates, external_ids=None):
+
+        self.coordinates = np.ascontiguousarray(coordinates, dtype=np.float64)
+        self.coordinates = self.coordinates.reshape(-1, 2)
+        self.ids = np.arange(len(self.coordinates), dtype=np.int32)
+
+        if external_ids is not None:
+            external_ids = pd.Index(external_ids)
+            if len(external_ids) != len(self.coordinates):
+                raise ValueError("Need one external id for each point")
+        self.external_ids = external_ids
+
+        self._tree = None
+        self._nearest = None
+
+    def __len__(self):
+        return len(self.coordinates)
+
+    @property
+    def tree(self):
+        # built the first time it is needed and then shared
+        if self._tree is None:
+            instrumentation.count("kdtree builds")
+            with instrumentation.stage("kdtree build"):
+                self._tree = KDTree(self.coordinates)
+
+        return self._tree
+
+    def nearest(self, k_nearest_neighbours):
+        # the distances to and ids of the k nearest points to every point, itself
+        # included, as arrays with a row per point. These are queried once and
+        # shared, and only queried again for a larger k
+        k_nearest_neighbours = min(k_nearest_neighbours, len(self))
+        if self._nearest is None or self._nearest[1].shape[1] < k_nearest_neighbours:
+            instrumentation.count("tree queries", len(self))
+            distances, ids = self.tree.query(self.coordinates, k_nearest_neighbours)
+            self._nearest = (
+                distances.reshape(len(self), -1),
+                ids.reshape(len(self), -1).astype(np.int32),
+            )
+
+        return (
+            self._nearest[0][:, :k_nearest_neighbours],
+            self._nearest[1][:, :k_nearest_neighbours],
+        )
+
+    def to_external(self, ids):
+        # the external ids of the given points, or the ids themselves if there are none
+        ids = np.asarray(ids, dtype=np.int32)
+        if self.external_ids is None:
+            return ids
+
+        return self.external_ids[ids].to_numpy()
+
+    def to_internal(self, external_ids):
+        if self.external_ids is None:
+            return np.asarray(external_ids, dtype=np.int32)
+
+        ids = self.external_ids.get_indexer(external_ids)
+        if np.any(ids < 0):
+            raise KeyError("Some ids are not in the point set")
+
+        return ids.astype(np.int32)
+
+    def to_frame(self):
+        # a DataFrame of the coordinates indexed by the external ids
+        return pd.DataFrame(
+            self.coordinates, columns=["x", "y"], index=self.external_ids
+        )
+
+    @classmethod
+    def from_data_points(cls, data_points):
+        # from a DataFrame with x and y columns, whose index is kept as the external
+        # ids unless it is just the row numbers, or from an array of coordinates
+        if isinstance(data_points, PointSet):
+            return data_points
+
+        if not isinstance(data_points, pd.DataFrame):
+            return cls(data_points)
+
+        if "x" in data_points.columns and "y" in data_points.columns:
+            coordinates = data_points[["x", "y"]].to_numpy()
+        else:
+            coordinates = data_points.iloc[:, :2].to_numpy()
+
+        external_ids = data_points.index
+        if external_ids.equals(pd.RangeIndex(len(data_points))):
+            external_ids = None
+
+        return cls(coordinates, external_ids)
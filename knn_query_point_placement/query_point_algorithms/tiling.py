@@ -0,0 +1,182 @@
+import os
+import sys
+import math
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.spatial import KDTree
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(root_dir)
+from query_point_algorithms import (
+    greedy_set_cover,
+    instrumentation,
+    local_search,
+    point_set,
+)
+
+
+# solve large datasets tile by tile. The bounding box of the data is split into a grid
+# of tiles and every data point is owned by the tile it falls in. Each tile's problem
+# is its own points plus a halo of the points around it, twice as wide as the furthest
+# k nearest neighbour of any point it owns, so the neighbourhoods of the owned points
+# are complete. Any placement algorithm then runs on each tile in a process pool, and
+# only the query points returning at least one owned point are kept. Finally the plans
+# are merged: every query point is checked against the whole dataset, any point left
+# uncovered gets a query point of its own, and query points whose neighbours are all
+# returned by other query points, e.g. where two tiles both covered their border, are
+# removed.
+
+
+def _tile_edges(coordinates, n_tiles):
+    # the edges of n_tiles equal tiles along each axis of the bounding box
+    lower = coordinates.min(axis=0)
+    upper = coordinates.max(axis=0)
+
+    return [np.linspace(lower[axis], upper[axis], n_tiles + 1) for axis in range(2)]
+
+
+def _tile_of_points(coordinates, edges):
+    # the row and column of the tile each point falls in, points on an inner edge go to
+    # the tile above it
+    return [
+        np.clip(
+            np.searchsorted(edges[axis], coordinates[:, axis], side="right") - 1,
+            0,
+            len(edges[axis]) - 2,
+        )
+        for axis in range(2)
+    ]
+
+
+def tiles(data_points, k_nearest_neighbours, n_tiles):
+    # a list of tiles, each a dictionary with the ids of the points in the tile's
+    # problem and which of them the tile owns. Tiles owning no points are left out
+    points = point_set.PointSet.from_data_points(data_points)
+    coordinates = points.coordinates
+    k_nearest_neighbours = min(k_nearest_neighbours, len(points))
+
+    # the distance from every point to its furthest k nearest neighbour
+    reach = points.nearest(k_nearest_neighbours)[0][:, -1]
+
+    edges = _tile_edges(coordinates, n_tiles)
+    rows, columns = _tile_of_points(coordinates, edges)
+    tile_of_point = rows * n_tiles + columns
+
+    order = np.argsort(tile_of_point, kind="stable")
+    offsets = np.searchsorted(tile_of_point[order], np.arange(n_tiles**2 + 1))
+
+    all_tiles = []
+    for tile in range(n_tiles**2):
+        owned = order[offsets[tile] : offsets[tile + 1]]
+        if len(owned) == 0:
+            continue
+
+        # every point within the halo of the tile's box
+        row, column = divmod(tile, n_tiles)
+        halo = 2 * reach[owned].max()
+        lower = np.array([edges[0][row], edges[1][column]]) - halo
+        upper = np.array([edges[0][row + 1], edges[1][column + 1]]) + halo
+        in_box = np.all((coordinates >= lower) & (coordinates <= upper), axis=1)
+
+        ids = np.flatnonzero(in_box).astype(np.int32)
+        all_tiles.append({"ids": ids, "owned": np.isin(ids, owned)})
+
+    return all_tiles
+
+
+def _solve_tile(algorithm, coordinates, owned, k_nearest_neighbours, kwargs):
+    # runs in a worker process. Returns the query points of the tile's plan which
+    # return at least one point the tile owns
+    k_nearest_neighbours = min(k_nearest_neighbours, len(coordinates))
+    query_points = np.asarray(
+        algorithm(coordinates, k_nearest_neighbours, **kwargs), dtype=float
+    ).reshape(-1, 2)
+
+    neighbours = KDTree(coordinates).query(query_points, k_nearest_neighbours)[1]
+    neighbours = neighbours.reshape(len(query_points), -1)
+
+    return query_points[np.any(owned[neighbours], axis=1)]
+
+
+def merge(data_points, k_nearest_neighbours, query_points):
+    # combine the tiles' query points into one plan for the whole dataset, checking it
+    # returns every point
+    points = point_set.PointSet.from_data_points(data_points)
+    k_nearest_neighbours = min(k_nearest_neighbours, len(points))
+    query_points = np.asarray(query_points, dtype=float).reshape(-1, 2)
+
+    def neighbours_of(query_points):
+        neighbours = points.tree.query(query_points, k_nearest_neighbours)[1]
+        return neighbours.reshape(len(query_points), -1)
+
+    # a point returned by no query point is queried from itself
+    neighbours = neighbours_of(query_points)
+    covered = np.zeros(len(points), dtype=bool)
+    covered[neighbours] = True
+    repairs = points.coordinates[~covered]
+    if len(repairs) > 0:
+        query_points = np.concatenate([query_points, repairs])
+        neighbours = np.concatenate([neighbours, neighbours_of(repairs)])
+
+    kept = local_search.remove_redundant(neighbours, len(points))
+    query_points = query_points[kept]
+
+    covered = np.zeros(len(points), dtype=bool)
+    covered[neighbours_of(query_points)] = True
+    if not np.all(covered):
+        raise RuntimeError(
+            f"The merged plan does not return {np.count_nonzero(~covered)} points"
+        )
+
+    return query_points, {"repaired": len(repairs), "removed": int(np.sum(~kept))}
+
+
+def get_query_points(
+    data_points,
+    k_nearest_neighbours,
+    algorithm=greedy_set_cover.get_query_points,
+    n_tiles=None,
+    points_per_tile=5000,
+    workers=None,
+    verbose=False,
+    **kwargs,
+):
+    # algorithm is any function taking an array of coordinates and k, e.g. the
+    # get_query_points of another module, with kwargs passed on to it. It has to be
+    # defined at the top level of a module so the workers can unpickle it. By default
+    # there are enough tiles for each to own about points_per_tile points
+    points = point_set.PointSet.from_data_points(data_points)
+    if n_tiles is None:
+        n_tiles = max(math.ceil(math.sqrt(len(points) / points_per_tile)), 1)
+
+    with instrumentation.stage("tiles"):
+        all_tiles = tiles(points, k_nearest_neighbours, n_tiles)
+    instrumentation.count("tiles", len(all_tiles))
+
+    tile_args = [
+        [algorithm] * len(all_tiles),
+        [points.coordinates[tile["ids"]] for tile in all_tiles],
+        [tile["owned"] for tile in all_tiles],
+        [k_nearest_neighbours] * len(all_tiles),
+        [kwargs] * len(all_tiles),
+    ]
+
+    if workers == 1:
+        plans = list(map(_solve_tile, *tile_args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            plans = list(executor.map(_solve_tile, *tile_args))
+
+    with instrumentation.stage("tile merge"):
+        query_points, report = merge(
+            points, k_nearest_neighbours, np.concatenate([np.zeros((0, 2))] + plans)
+        )
+
+    if verbose:
+        print(
+            f"Found all {len(points)} points with {len(query_points)} query points from"
+            f" {len(all_tiles)} tiles, adding {report['repaired']} and removing"
+            f" {report['removed']} when merging"
+        )
+
+    return query_points
@@ -1,67 +1,139 @@
-from scipy.spatial import KDTree
+import os
+import sys
+import heapq
 import numpy as np
 
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(root_dir)
+from query_point_algorithms import instrumentation, point_set
+
 
 def extreme_point(data_points, k_nearest_neighbours):
     # defined as the point appearing least in other points k nearest neighbours
-    tree = KDTree(data_points[["x", "y"]].to_numpy())
+    points = point_set.PointSet.from_data_points(data_points)
 
     # find the closest k points to each point
-    closest_k = tree.query(data_points[["x", "y"]].to_numpy(), k_nearest_neighbours)
+    closest_k = points.nearest(k_nearest_neighbours)
 
     # find how many times each point appears in the k nearest neighbours or other points
     counts_for_each_point = np.unique(closest_k[1], return_counts=True)[1]
 
-    # select the one which appears the least
-    extreme_point = data_points.index[np.argmin(counts_for_each_point)]
+    # select the one which appears the least, as its label in data_points
+    extreme_point = points.to_external([np.argmin(counts_for_each_point)])[0]
 
     return extreme_point
 
 
+def _next_neighbour(point, candidates, position, remaining, tree, coordinates):
+    # the nearest remaining point to point which is not already one of its k nearest
+    # neighbours, fetching more candidates from the tree when they run out
+    while True:
+        if position[point] == len(candidates[point]):
+            if len(candidates[point]) == len(coordinates):
+                return None
+
+            n_candidates = min(2 * len(candidates[point]), len(coordinates))
+            instrumentation.count("tree queries")
+            candidates[point] = tree.query(coordinates[point], n_candidates)[1].tolist()
+
+        neighbour = candidates[point][position[point]]
+        position[point] += 1
+
+        if remaining[neighbour]:
+            return neighbour
+
+
+@instrumentation.timed("trim extremities")
 def get_query_points(data_points, k_nearest_neighbours, verbose=False):
 
-    all_points_tree = KDTree(data_points[["x", "y"]].to_numpy())
-    returned_points = set()
+    # repeatedly set the extreme point of the points not yet returned as the centre of
+    # a search query. Rather than rebuilding the tree for the remaining points every
+    # time, we keep each remaining point's k nearest remaining neighbours and how often
+    # each point appears in them, and only update the neighbourhoods of the points
+    # which are returned
+    points = point_set.PointSet.from_data_points(data_points)
+    coordinates = points.coordinates
+    n_points = len(coordinates)
+    k_nearest_neighbours = min(k_nearest_neighbours, n_points)
+    tree = points.tree
+
+    n_candidates = min(2 * k_nearest_neighbours, n_points)
+    first_candidates = points.nearest(n_candidates)[1]
+    candidates = first_candidates.tolist()
+    position = [k_nearest_neighbours] * n_points
+
+    neighbours = [set(row[:k_nearest_neighbours]) for row in candidates]
+    appears_in = [set() for _ in range(n_points)]
+    for point, point_neighbours in enumerate(neighbours):
+        for neighbour in point_neighbours:
+            appears_in[neighbour].add(point)
+
+    # a heap of how many times each point appears, ties going to the first point in
+    # data_points. Entries are left in place when a count changes, and skipped when
+    # they are popped if they are out of date
+    counts = [len(points) for points in appears_in]
+    heap = list(zip(counts, range(n_points)))
+    heapq.heapify(heap)
+
+    remaining = [True] * n_points
+    n_returned = 0
     query_points = []
 
-    # recursively set the extreme point as the centre of the search query and then find the
-    # next extreme point
-    while len(returned_points) < len(data_points):
+    while n_returned < n_points:
 
+        instrumentation.progress("trim extremities", n_returned, n_points)
         if verbose:
             print(
                 "Returned points =",
-                len(returned_points),
+                n_returned,
                 "out of",
-                len(data_points),
+                n_points,
                 "points",
                 end="\r",
             )
 
-        # get uuids of possible points
-        possible_points = [
-            point for point in data_points.index if point not in returned_points
-        ]
-
-        # # filter coordinates to possible points
-        updated_data_points = data_points.loc[possible_points].copy()
-
-        # # find extreme point
-        point = extreme_point(updated_data_points, k_nearest_neighbours)
+        # the extreme point is the one appearing least in the other points k nearest
+        # neighbours
+        count, point = heapq.heappop(heap)
+        if not remaining[point] or count != counts[point]:
+            continue
 
-        # find the k nearest in the original to this one
-        k_nearest = all_points_tree.query(
-            data_points.loc[point].to_numpy().reshape(-1), k_nearest_neighbours
-        )[1]
-        k_nearest_uuids = set(data_points.index[k_nearest])
-
-        # add to list of query points
         query_points += [point]
 
-        # add neighbours to list of returned points
-        returned_points = returned_points.union(k_nearest_uuids)
+        # the query returns the k nearest of all the points
+        returned = [
+            neighbour
+            for neighbour in first_candidates[point, :k_nearest_neighbours].tolist()
+            if remaining[neighbour]
+        ]
+        for returned_point in returned:
+            remaining[returned_point] = False
+        n_returned += len(returned)
+
+        # returned points no longer count towards the points they were near
+        for returned_point in returned:
+            for neighbour in neighbours[returned_point]:
+                counts[neighbour] -= 1
+                appears_in[neighbour].discard(returned_point)
+                if remaining[neighbour]:
+                    heapq.heappush(heap, (counts[neighbour], neighbour))
+            neighbours[returned_point] = set()
+
+        # and the remaining points they were near replace them with their next nearest
+        for returned_point in returned:
+            for point in appears_in[returned_point]:
+                neighbours[point].discard(returned_point)
+                neighbour = _next_neighbour(
+                    point, candidates, position, remaining, tree, coordinates
+                )
+                if neighbour is not None:
+                    neighbours[point].add(neighbour)
+                    appears_in[neighbour].add(point)
+                    counts[neighbour] += 1
+                    heapq.heappush(heap, (counts[neighbour], neighbour))
+            appears_in[returned_point] = set()
 
     if verbose:
         print("\n")
 
-    return data_points.loc[query_points][["x", "y"]].to_numpy()
+    return coordinates[query_points]
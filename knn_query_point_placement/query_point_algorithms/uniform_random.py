@@ -1,47 +1,88 @@
+import os
+import sys
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from scipy.spatial import KDTree
 
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(root_dir)
+from query_point_algorithms import instrumentation, point_set
 
-def sample_next_query_point(remaining_data_points):
-    # sample a point from the remaining data points
-    point = remaining_data_points.sample(1).iloc[0].to_dict()
 
-    return np.array([point["x"], point["y"]])
+def _random_cover(coordinates, k_nearest_neighbours, seed, batch_size=1024, tree=None):
+    # returns the indices of the data points used as query points. The first uncovered
+    # point of a random permutation is a uniform sample of the uncovered points, so we
+    # walk a permutation of the points, looking up the neighbours of the uncovered
+    # ones in the next batch_size positions in one query
+    if tree is None:
+        tree = KDTree(coordinates)
+    order = np.random.default_rng(seed).permutation(len(coordinates))
+    uncovered = np.ones(len(coordinates), dtype=bool)
 
+    query_points = []
+    for start in range(0, len(order), batch_size):
+        batch = order[start : start + batch_size]
+        batch = batch[uncovered[batch]]
+        if len(batch) == 0:
+            continue
 
-# add points uniformly at random until we cover all our points
-def get_query_points(data_points, k_nearest_neighbours, verbose=False):
+        instrumentation.count("tree queries", len(batch))
+        neighbours = tree.query(coordinates[batch], k_nearest_neighbours)[1]
+        neighbours = neighbours.reshape(len(batch), -1)
 
-    tree = KDTree(data_points[["x", "y"]].to_numpy())
+        for point, point_neighbours in zip(batch, neighbours):
+            # the point may have been covered by an earlier one in this batch
+            if uncovered[point]:
+                query_points += [point]
+                uncovered[point_neighbours] = False
 
-    # get the initial point
-    intial_point = sample_next_query_point(data_points)
+    return np.array(query_points, dtype=int)
 
-    # get the neighbours of the initial point
-    neighbours = tree.query(intial_point, k_nearest_neighbours)[1]
-    number_of_unique_neighbours = len(set(neighbours))
 
-    # now iterate until we have all the points
-    query_points = [intial_point]
+# add points uniformly at random until we cover all our points
+@instrumentation.timed("uniform random")
+def get_query_points(
+    data_points,
+    k_nearest_neighbours,
+    verbose=False,
+    n_starts=1,
+    workers=None,
+    seed=None,
+):
 
-    while number_of_unique_neighbours < len(data_points):
-        if verbose:
-            print(
-                f"Found {number_of_unique_neighbours} out of {len(data_points)} points"
-            )
+    points = point_set.PointSet.from_data_points(data_points)
+    coordinates = points.coordinates
+    k_nearest_neighbours = min(k_nearest_neighbours, len(coordinates))
 
-        # remove the neighbours from the data points
-        remaining_data = data_points.drop(neighbours).copy()
+    # by default draw the seed from numpy's global random state, so np.random.seed
+    # still makes the result reproducible
+    if seed is None:
+        seed = np.random.randint(2**32)
+    seeds = np.random.SeedSequence(seed).spawn(n_starts)
 
-        # sample a new point
-        new_point = sample_next_query_point(remaining_data)
-        query_points += [new_point]
+    # with several starts run them in parallel and keep the smallest plan
+    if n_starts == 1:
+        plans = [
+            _random_cover(coordinates, k_nearest_neighbours, seeds[0], tree=points.tree)
+        ]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            plans = list(
+                executor.map(
+                    _random_cover,
+                    [coordinates] * n_starts,
+                    [k_nearest_neighbours] * n_starts,
+                    seeds,
+                )
+            )
 
-        # get the neighbours of the new point
-        new_neighbours = tree.query(new_point, k_nearest_neighbours)[1]
+    best_plan = min(plans, key=len)
 
-        # add the new neighbours to the list of neighbours
-        neighbours = set(neighbours).union(set(new_neighbours))
-        number_of_unique_neighbours = len(neighbours)
+    if verbose:
+        sizes = [len(plan) for plan in plans]
+        print(
+            f"Found all {len(coordinates)} points with {len(best_plan)} query points,"
+            f" from {n_starts} starts of between {min(sizes)} and {max(sizes)}"
+        )
 
-    return np.array(query_points)
+    return coordinates[best_plan]
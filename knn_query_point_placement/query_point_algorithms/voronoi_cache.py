@@ -0,0 +1,125 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+
+# an on disk cache of order k voronoi cells, so replanning the same points with other
+# solvers or parameters does not rebuild the diagram. Each entry is a directory of
+# .npy files named by a hash of the coordinates, the order, the construction method
+# and the metric, holding every cell's halfspaces padded to the same length, its
+# neighbour set and its viable point (NaN where it has none). The arrays are memory
+# mapped when an entry is loaded, so only the parts that are used are read. Reading an
+# entry touches its directory, and when the cache is over max_bytes the least recently
+# used entries are deleted.
+
+
+_ARRAYS = ["A", "b", "n_constraints", "neighbour_sets", "viable_points"]
+
+
+def _size(path):
+    return sum(
+        os.path.getsize(os.path.join(path, name))
+        for name in os.listdir(path)
+        if os.path.isfile(os.path.join(path, name))
+    )
+
+
+class VoronoiCache:
+    def __init__(self, directory, max_bytes=2**30):
+
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(coordinates, nth_order, method="order_k", metric="euclidean"):
+        # the fingerprint of a dataset and the diagram built from it
+        coordinates = np.ascontiguousarray(coordinates, dtype=np.float64)
+        fingerprint = hashlib.sha256(coordinates.tobytes())
+        fingerprint.update(
+            f"{coordinates.shape}/{nth_order}/{method}/{metric}".encode()
+        )
+
+        return fingerprint.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, key):
+        return os.path.isdir(self._path(key))
+
+    def load(self, key):
+        # the arrays of an entry memory mapped, or None if it is not in the cache
+        path = self._path(key)
+        if key not in self:
+            return None
+
+        os.utime(path)
+
+        return {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            for name in _ARRAYS
+        }
+
+    def save(self, key, cells, viable_points):
+        # cells is a list of VoronoiCell and viable_points the list find_viable_points
+        # returns for them. The entry is written to a temporary directory first, so a
+        # partly written entry is never loaded
+        n_constraints = np.array([len(cell.b) for cell in cells], dtype=np.int64)
+        max_constraints = n_constraints.max(initial=0)
+
+        A = np.zeros((len(cells), max_constraints, 2))
+        b = np.zeros((len(cells), max_constraints))
+        for i, cell in enumerate(cells):
+            A[i, : n_constraints[i]] = cell.A
+            b[i, : n_constraints[i]] = cell.b
+
+        arrays = {
+            "A": A,
+            "b": b,
+            "n_constraints": n_constraints,
+            "neighbour_sets": np.array(
+                [cell.nearest_neighbours for cell in cells], dtype=np.int32
+            ).reshape(len(cells), -1),
+            "viable_points": np.array(
+                [
+                    np.full(2, np.nan) if point is None else point
+                    for point in viable_points
+                ]
+            ).reshape(len(cells), 2),
+        }
+
+        staging = tempfile.mkdtemp(dir=self.directory, prefix=".")
+        for name, array in arrays.items():
+            np.save(os.path.join(staging, f"{name}.npy"), array)
+
+        if key in self:
+            shutil.rmtree(staging)
+        else:
+            os.rename(staging, self._path(key))
+
+        self.evict()
+
+    def evict(self):
+        # delete the least recently used entries until the cache fits in max_bytes
+        entries = [
+            self._path(name)
+            for name in os.listdir(self.directory)
+            if not name.startswith(".")
+        ]
+        entries.sort(key=os.path.getmtime)
+        sizes = [_size(entry) for entry in entries]
+
+        total = sum(sizes)
+        for entry, size in zip(entries, sizes):
+            if total <= self.max_bytes:
+                break
+
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            shutil.rmtree(self._path(name), ignore_errors=True)
@@ -0,0 +1,72 @@
+import os
+import sys
+import numpy as np
+from scipy.spatial import KDTree
+
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(root_dir)
+import query_executor
+from query_point_algorithms import adaptive_planner
+
+
+def _coordinates(n_points=200, seed=0):
+    return np.random.default_rng(seed).uniform(0, 10, (n_points, 2))
+
+
+def _run(planner, answer, max_waves=1000):
+    # run the plan to the end, failing the test rather than looping forever
+    for _ in range(max_waves):
+        if planner.done:
+            return planner.report()
+
+        query_ids, query_points = planner.next_wave(16)
+        planner.update(query_ids, [answer(query_point) for query_point in query_points])
+
+    raise AssertionError("The plan did not finish")
+
+
+def test_permanently_failing_queries_are_given_up():
+    coordinates = _coordinates()
+    tree = KDTree(coordinates)
+    planner = adaptive_planner.AdaptivePlanner(coordinates, 5, max_attempts=3)
+
+    # every query in the left half of the space fails
+    def answer(query_point):
+        if query_point[0] < 5:
+            return None
+
+        return tree.query(query_point, 5)[1].tolist()
+
+    report = _run(planner, answer)
+
+    assert np.all(planner.attempts <= 3)
+    assert report["failed"] > 0
+    assert report["uncovered"] > 0
+    assert report["covered"] + report["uncovered"] == len(coordinates)
+
+    # the points no failed query was to return are all covered
+    assert np.all(planner.covered[planner.given_up == 0])
+
+
+def test_every_query_failing_finishes_with_nothing_covered():
+    coordinates = _coordinates(50)
+    planner = adaptive_planner.AdaptivePlanner(coordinates, 4, max_attempts=2)
+
+    report = _run(planner, lambda query_point: None)
+
+    assert report["queries"] == 0
+    assert report["covered"] == 0
+    assert report["uncovered"] == len(coordinates)
+
+
+def test_execute_adaptive_finishes_with_a_failing_backend():
+    coordinates = _coordinates(100)
+    planner = adaptive_planner.AdaptivePlanner(coordinates, 5)
+
+    async def backend(query_point):
+        raise ConnectionError("The API is down")
+
+    report = query_executor.execute_adaptive(planner, backend, max_retries=0)
+
+    assert report["records"] == {}
+    assert report["uncovered"] == len(coordinates)